@@ -0,0 +1,69 @@
+from consumer_supervisor import ConsumerSupervisor
+from priority_notification_manager import PriorityNotificationManager
+import argparse
+import boto3
+import os
+import sys
+import time
+
+# Benchmark de throughput del supervisor contra un AWS local (LocalStack, ElasticMQ...).
+# boto3 usa AWS_ENDPOINT_URL para dirigir todas las llamadas al servicio local.
+# Uso: AWS_ENDPOINT_URL=http://localhost:4566 python bench_consumer_supervisor.py --messages 2000
+
+def quiet_manager():
+    # Los prints por mensaje dominarían la medición
+    sys.stdout = open(os.devnull, 'w')
+    return PriorityNotificationManager()
+
+def setup_local_resources():
+    os.environ.setdefault('ACCESS_KEY_ID', 'test')
+    os.environ.setdefault('SECRET_ACCESS_KEY', 'test')
+    sqs = boto3.client('sqs', region_name='us-east-2', aws_access_key_id='test', aws_secret_access_key='test')
+    for level in ('high', 'medium', 'low'):
+        url = sqs.create_queue(QueueName=f'bench-{level}')['QueueUrl']
+        os.environ[f'SQS_{level.upper()}_PRIORITY_URL'] = url
+    sns = boto3.client('sns', region_name='us-east-2', aws_access_key_id='test', aws_secret_access_key='test')
+    os.environ['ARN'] = sns.create_topic(Name='bench-notifications')['TopicArn']
+    manager = PriorityNotificationManager()
+    manager.create_notifications_table()
+    return manager
+
+def seed(manager, messages):
+    manager.priority_queue.purge()
+    for i in range(messages):
+        manager.priority_queue.put('medium', (
+            'Offer', f'BenchUser_{i}', 'bench@example.com',
+            {'beauty_salon_id': f'BenchSalon_{i % 50}', 'offer_id': f'offer-{i}', 'description': 'Bench offer'}
+        ), shard_key=f'BenchUser_{i}')
+
+def run(processes, messages):
+    manager = setup_local_resources()
+    seed(manager, messages)
+    supervisor = ConsumerSupervisor(processes=processes, manager_factory=quiet_manager)
+    supervisor.start()
+    started_at = time.time()
+    while supervisor.stats['processed'] + supervisor.stats['failed'] < messages:
+        supervisor.collect_stats(timeout=1)
+        supervisor.check_workers()
+    elapsed = time.time() - started_at
+    supervisor.drain()
+    return messages / elapsed
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--max-processes', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    if not os.getenv('AWS_ENDPOINT_URL'):
+        print("❌ Define AWS_ENDPOINT_URL apuntando a un AWS local")
+        return
+
+    processes = 1
+    while processes <= args.max_processes:
+        throughput = run(processes, args.messages)
+        print(f"📊 {processes} procesos: {throughput:.1f} mensajes/s")
+        processes *= 2
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+from message_templates import MessageTemplateRegistry
+import argparse
+import timeit
+
+# Benchmark del costo de renderizado por mensaje: f-string fija vs registro de plantillas
+# Uso: python bench_message_templates.py --messages 100000
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=100000)
+    parser.add_argument('--salons', type=int, default=500)
+    args = parser.parse_args()
+
+    registry = MessageTemplateRegistry()
+    for i in range(0, args.salons, 10):
+        registry.register(
+            'Offer',
+            "Nueva oferta de {beauty_salon_id}",
+            "Hola {user_id},\n\n{beauty_salon_id} tiene una nueva oferta: {description}.",
+            beauty_salon_id=f'salon-{i}',
+            locale='es'
+        )
+    contexts = [
+        {'user_id': f'user-{i}', 'description': '50% de descuento', 'offer_id': f'offer-{i}'}
+        for i in range(args.messages)
+    ]
+
+    def baseline():
+        for i, context in enumerate(contexts):
+            beauty_salon_id = f'salon-{i % args.salons}'
+            subject = "New Offer Available"
+            body = f"Hello {context['user_id']},\n\nBeauty salon {beauty_salon_id} has a new offer: {context['description']}."
+
+    def render():
+        for i, context in enumerate(contexts):
+            registry.render('Offer', f'salon-{i % args.salons}', 'es', **context)
+
+    def render_many():
+        for salon in range(args.salons):
+            registry.render_many('Offer', contexts[salon::args.salons], f'salon-{salon}', 'es')
+
+    for name, function in (('f-string', baseline), ('render', render), ('render_many', render_many)):
+        elapsed = min(timeit.repeat(function, number=1, repeat=3))
+        print(f"📊 {name}: {elapsed / args.messages * 1e9:.0f} ns/mensaje")
+    print(f"📊 Caché: {registry.stats}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+import math
+import threading
+import time
+
+class AutoscalingConsumerPool:
+    def __init__(self, manager, min_workers=1, max_workers=8, scale_interval=10, target_drain_seconds=60,
+                 scale_down_after=3, depth_refresh_interval=5):
+        self.manager = manager
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.scale_interval = scale_interval
+        # Tiempo en el que se quiere vaciar el backlog actual
+        self.target_drain_seconds = target_drain_seconds
+        # Histéresis: se reduce un worker solo tras varias evaluaciones seguidas con exceso
+        self.scale_down_after = scale_down_after
+        self.depth_refresh_interval = depth_refresh_interval
+        self._workers = []  # [(thread, stop_event)]
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._scaler_thread = None
+        self._below_target_count = 0
+        self._processed = 0
+        self._last_processed = 0
+        self._empty_polls = 0  # Recepciones vacías desde la última evaluación
+        self._owns_sampler = False
+        self._last_evaluation = None
+        self.drain_rate = 0.0  # mensajes por segundo por worker (media móvil)
+        self.stats = {'scale_ups': 0, 'scale_downs': 0, 'processed': 0, 'failed': 0}
+
+    def start(self):
+        queue = self.manager.priority_queue
+        if queue.depth_sampler is None or not queue.depth_sampler.is_running():
+            queue.start_depth_sampler(self.depth_refresh_interval)
+            self._owns_sampler = True  # Se detiene en stop()
+        self._stop_event.clear()
+        self._last_evaluation = time.time()
+        self._resize(self.min_workers)
+        self._scaler_thread = threading.Thread(target=self._scale_loop, daemon=True)
+        self._scaler_thread.start()
+        print(f"🚀 Pool de consumidores iniciado con {self.min_workers} workers")
+
+    def stop(self):
+        # Los workers terminan el mensaje en curso antes de salir
+        self._stop_event.set()
+        if self._scaler_thread is not None:
+            self._scaler_thread.join()
+            self._scaler_thread = None
+        self._resize(0)
+        self.manager.priority_queue.release_buffered()
+        if self._owns_sampler:
+            self.manager.priority_queue.stop_depth_sampler()
+            self._owns_sampler = False
+        self.manager.flush_offer_digests(force=True)
+        self.manager.flush_diagnostics()
+        print(f"✅ Pool de consumidores detenido. Items procesados: {self.stats['processed']}")
+
+    def worker_count(self):
+        with self._lock:
+            return len(self._workers)
+
+    def desired_workers(self, backlog, current_workers):
+        if backlog == 0:
+            return self.min_workers
+        if self.drain_rate <= 0:
+            # Aún no hay tasa de drenado observada: crecer de a un worker
+            desired = current_workers + 1
+        else:
+            desired = math.ceil(backlog / (self.drain_rate * self.target_drain_seconds))
+        return max(self.min_workers, min(self.max_workers, desired))
+
+    def evaluate(self):
+        now = time.time()
+        with self._lock:
+            processed = self._processed
+            current_workers = len(self._workers)
+            empty_polls = self._empty_polls
+            self._empty_polls = 0
+        elapsed = max(now - self._last_evaluation, 1e-6)
+        # La tasa solo se mide en intervalos en que los workers tuvieron trabajo todo el
+        # tiempo; medida con la cola vacía subestima la capacidad y dispara el escalado
+        if current_workers and processed > self._last_processed and not empty_polls:
+            observed_rate = (processed - self._last_processed) / elapsed / current_workers
+            # Media móvil exponencial para suavizar la tasa de drenado por worker
+            self.drain_rate = observed_rate if self.drain_rate == 0 else 0.7 * self.drain_rate + 0.3 * observed_rate
+        self._last_processed = processed
+        self._last_evaluation = now
+
+        backlog = self.manager.priority_queue.depth_sampler.depth()
+        desired = self.desired_workers(backlog, current_workers)
+        if desired > current_workers:
+            self._below_target_count = 0
+            self.stats['scale_ups'] += 1
+            print(f"📈 Backlog {backlog}: escalando de {current_workers} a {desired} workers")
+            self._resize(desired)
+        elif desired < current_workers:
+            self._below_target_count += 1
+            if self._below_target_count >= self.scale_down_after:
+                self._below_target_count = 0
+                self.stats['scale_downs'] += 1
+                print(f"📉 Backlog {backlog}: reduciendo de {current_workers} a {current_workers - 1} workers")
+                self._resize(current_workers - 1)
+        else:
+            self._below_target_count = 0
+        return desired
+
+    def _resize(self, target):
+        stopped = []
+        with self._lock:
+            while len(self._workers) < target:
+                stop_event = threading.Event()
+                thread = threading.Thread(target=self._worker_loop, args=(stop_event,), daemon=True)
+                self._workers.append((thread, stop_event))
+                thread.start()
+            while len(self._workers) > target:
+                thread, stop_event = self._workers.pop()
+                stop_event.set()
+                stopped.append(thread)
+        for thread in stopped:
+            thread.join()
+
+    def _worker_loop(self, stop_event):
+        while not stop_event.is_set():
+            try:
+                outcome = self.manager.consume_once()
+            except Exception as e:
+                print(f"❌ Error en worker del pool: {e}")
+                continue
+            with self._lock:
+                if outcome is None:
+                    self._empty_polls += 1
+                elif outcome:
+                    self._processed += 1
+                    self.stats['processed'] += 1
+                else:
+                    self.stats['failed'] += 1
+
+    def _scale_loop(self):
+        while not self._stop_event.wait(self.scale_interval):
+            try:
+                self.evaluate()
+            except Exception as e:
+                print(f"❌ Error evaluando el escalado del pool: {e}")
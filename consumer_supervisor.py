@@ -0,0 +1,135 @@
+from priority_notification_manager import PriorityNotificationManager
+import argparse
+import multiprocessing
+import os
+import queue
+import signal
+import time
+
+def consumer_process(worker_id, drain_event, stats_queue, manager_factory, report_interval):
+    # Cada proceso crea su propio manager, con sus propios clientes de boto3
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # El supervisor coordina la parada
+    signal.signal(signal.SIGTERM, lambda signum, frame: drain_event.set())
+    manager = manager_factory()
+    processed, failed = 0, 0
+    last_report = time.time()
+
+    while not drain_event.is_set():
+        try:
+            outcome = manager.consume_once()
+        except Exception as e:
+            print(f"❌ Error en el proceso consumidor {worker_id}: {e}")
+            outcome = None
+        if outcome is True:
+            processed += 1
+        elif outcome is False:
+            failed += 1
+
+        if time.time() - last_report >= report_interval:
+            stats_queue.put((worker_id, processed, failed))
+            processed, failed = 0, 0
+            last_report = time.time()
+
+    # Los mensajes pre-cargados (modo EDF) no se procesarán en este proceso
+    manager.priority_queue.release_buffered()
+    manager.flush_offer_digests(force=True)
+    manager.flush_diagnostics()
+    stats_queue.put((worker_id, processed, failed))
+
+class ConsumerSupervisor:
+    def __init__(self, processes=None, manager_factory=PriorityNotificationManager, report_interval=1,
+                 max_restarts=5, drain_timeout=60):
+        self.processes = processes or os.cpu_count() or 1
+        self.manager_factory = manager_factory
+        self.report_interval = report_interval
+        self.max_restarts = max_restarts  # Reinicios permitidos por worker
+        self.drain_timeout = drain_timeout
+        # 'spawn' evita heredar hilos y clientes de boto3 del proceso padre
+        self._context = multiprocessing.get_context('spawn')
+        self._drain_event = self._context.Event()
+        self._stats_queue = self._context.Queue()
+        self._workers = {}  # worker_id -> proceso
+        self._restarts = {}
+        self.stats = {'processed': 0, 'failed': 0, 'restarts': 0, 'workers': {}}
+
+    def start(self):
+        for worker_id in range(self.processes):
+            self._start_worker(worker_id)
+        print(f"🚀 Supervisor iniciado con {self.processes} procesos consumidores")
+
+    def run(self, duration=None):
+        # Bucle del supervisor: agrega estadísticas y reinicia los workers caídos
+        signal.signal(signal.SIGTERM, lambda signum, frame: self._drain_event.set())
+        signal.signal(signal.SIGINT, lambda signum, frame: self._drain_event.set())
+        self.start()
+        started_at = time.time()
+        while not self._drain_event.is_set():
+            self.collect_stats(timeout=self.report_interval)
+            self.check_workers()
+            if duration is not None and time.time() - started_at >= duration:
+                break
+        self.drain()
+        return self.stats
+
+    def check_workers(self):
+        for worker_id, process in list(self._workers.items()):
+            if process.is_alive() or self._drain_event.is_set():
+                continue
+            if self._restarts.get(worker_id, 0) >= self.max_restarts:
+                print(f"❌ El proceso consumidor {worker_id} superó el máximo de reinicios")
+                del self._workers[worker_id]
+                continue
+            print(f"🔄 Reiniciando proceso consumidor {worker_id} (código de salida {process.exitcode})")
+            self._restarts[worker_id] = self._restarts.get(worker_id, 0) + 1
+            self.stats['restarts'] += 1
+            self._start_worker(worker_id)
+
+    def collect_stats(self, timeout=0):
+        deadline = time.time() + timeout
+        while True:
+            try:
+                worker_id, processed, failed = self._stats_queue.get(timeout=max(0, deadline - time.time()))
+            except queue.Empty:
+                return
+            worker_stats = self.stats['workers'].setdefault(worker_id, {'processed': 0, 'failed': 0})
+            worker_stats['processed'] += processed
+            worker_stats['failed'] += failed
+            self.stats['processed'] += processed
+            self.stats['failed'] += failed
+
+    def drain(self):
+        # Parada ordenada: los workers terminan el mensaje en curso y reportan sus estadísticas
+        print("\n🛑 Drenando procesos consumidores...")
+        self._drain_event.set()
+        deadline = time.time() + self.drain_timeout
+        for process in self._workers.values():
+            process.join(timeout=max(0, deadline - time.time()))
+        for worker_id, process in self._workers.items():
+            if process.is_alive():
+                print(f"⚠️ El proceso consumidor {worker_id} no terminó a tiempo, forzando su salida")
+                process.terminate()
+                process.join()
+        self.collect_stats(timeout=0.5)
+        print(f"✅ Supervisor detenido. Items procesados: {self.stats['processed']}")
+
+    def _start_worker(self, worker_id):
+        process = self._context.Process(
+            target=consumer_process,
+            args=(worker_id, self._drain_event, self._stats_queue, self.manager_factory, self.report_interval),
+            daemon=True
+        )
+        process.start()
+        self._workers[worker_id] = process
+
+def main():
+    parser = argparse.ArgumentParser(description="Consumidores multi-proceso para PriorityNotificationManager")
+    parser.add_argument('--processes', type=int, default=None, help="Número de procesos (por defecto, número de CPUs)")
+    parser.add_argument('--duration', type=float, default=None, help="Segundos a ejecutar antes de drenar")
+    args = parser.parse_args()
+
+    supervisor = ConsumerSupervisor(processes=args.processes)
+    stats = supervisor.run(duration=args.duration)
+    print(f"📊 Estadísticas: {stats}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+from botocore.exceptions import ClientError
+import json
+import time
+import uuid
+
+class DeadLetterQueue:
+    def __init__(self, sqs_client, queue_url):
+        self.sqs = sqs_client
+        self.queue_url = queue_url
+        self.stats = {'quarantined': 0, 'replayed': 0, 'unreplayable': 0}
+
+    def quarantine(self, source_queue_url, priority_level, raw_body, reason, receive_count=None, error=None,
+                   group_id=None, message_attributes=None):
+        # Guardar el cuerpo original junto con los metadatos del fallo para poder re-enviarlo
+        # (incluidos el grupo FIFO y los atributos, p. ej. el traceparent)
+        message = {
+            'source_queue_url': source_queue_url,
+            'priority_level': priority_level,
+            'original_body': raw_body,
+            'reason': reason,
+            'error': error,
+            'receive_count': receive_count,
+            'quarantined_at': str(int(time.time())),
+            'group_id': group_id,
+            'message_attributes': message_attributes
+        }
+        params = {'QueueUrl': self.queue_url, 'MessageBody': json.dumps(message)}
+        if message_attributes:
+            params['MessageAttributes'] = message_attributes
+        if self.queue_url.endswith('.fifo'):
+            params['MessageGroupId'] = group_id or priority_level
+            params['MessageDeduplicationId'] = uuid.uuid4().hex  # Cada cuarentena es un envío distinto
+        try:
+            self.sqs.send_message(**params)
+            self.stats['quarantined'] += 1
+            print(f"☣️ Mensaje de la cola '{priority_level}' enviado a cuarentena ({reason})")
+            return True
+        except ClientError as e:
+            print(f"Error enviando mensaje a la cola de mensajes muertos: {e}")
+            return False
+
+    def replay(self, max_messages=None, priority_level=None):
+        # Re-enviar en lote los mensajes en cuarentena a su cola de origen
+        replayed = 0
+        while max_messages is None or replayed < max_messages:
+            batch_size = 10 if max_messages is None else min(10, max_messages - replayed)
+            try:
+                response = self.sqs.receive_message(
+                    QueueUrl=self.queue_url,
+                    MaxNumberOfMessages=batch_size,
+                    WaitTimeSeconds=1,
+                    VisibilityTimeout=30
+                )
+            except ClientError as e:
+                print(f"Error recibiendo mensajes de la cola de mensajes muertos: {e}")
+                break
+
+            messages = response.get('Messages', [])
+            if not messages:
+                break
+
+            by_source = {}
+            skipped = 0
+            for msg in messages:
+                try:
+                    entry = json.loads(msg['Body'])
+                    for key in ('source_queue_url', 'original_body'):
+                        if key not in entry:
+                            raise KeyError(key)
+                except (ValueError, KeyError, TypeError) as e:
+                    # Mensaje que no escribió quarantine() (p. ej. movido por una redrive policy
+                    # de SQS): se deja en la cola de mensajes muertos para revisarlo a mano
+                    print(f"⚠️ Mensaje {msg.get('MessageId', msg['ReceiptHandle'])} de la cola de mensajes muertos no se puede re-enviar: {e}")
+                    self.stats['unreplayable'] += 1
+                    continue
+                if priority_level and entry.get('priority_level') != priority_level:
+                    # Devolver a la cola los mensajes de otros niveles
+                    self.sqs.change_message_visibility(
+                        QueueUrl=self.queue_url,
+                        ReceiptHandle=msg['ReceiptHandle'],
+                        VisibilityTimeout=0
+                    )
+                    skipped += 1
+                    continue
+                by_source.setdefault(entry['source_queue_url'], []).append((msg, entry))
+
+            for source_queue_url, items in by_source.items():
+                try:
+                    result = self.sqs.send_message_batch(
+                        QueueUrl=source_queue_url,
+                        Entries=[self._replay_entry(i, source_queue_url, entry) for i, (_, entry) in enumerate(items)]
+                    )
+                except ClientError as e:
+                    print(f"Error re-enviando mensajes a la cola de origen: {e}")
+                    continue
+
+                # Solo se eliminan de la cola de mensajes muertos los que se re-enviaron
+                sent_ids = {int(success['Id']) for success in result.get('Successful', [])}
+                if sent_ids:
+                    self.sqs.delete_message_batch(
+                        QueueUrl=self.queue_url,
+                        Entries=[
+                            {'Id': str(i), 'ReceiptHandle': msg['ReceiptHandle']}
+                            for i, (msg, _) in enumerate(items) if i in sent_ids
+                        ]
+                    )
+                replayed += len(sent_ids)
+
+            if skipped == len(messages):
+                # Solo quedan mensajes de otros niveles
+                break
+
+        self.stats['replayed'] += replayed
+        print(f"✅ {replayed} mensajes re-enviados desde la cola de mensajes muertos")
+        return replayed
+
+    def _replay_entry(self, i, source_queue_url, entry):
+        replay_entry = {'Id': str(i), 'MessageBody': entry['original_body']}
+        if entry.get('message_attributes'):
+            replay_entry['MessageAttributes'] = entry['message_attributes']
+        if source_queue_url.endswith('.fifo'):
+            # Un id de deduplicación nuevo: el original haría que SQS descartara el
+            # re-envío si todavía está dentro de su ventana de 5 minutos
+            replay_entry['MessageGroupId'] = entry.get('group_id') or entry.get('priority_level') or 'default'
+            replay_entry['MessageDeduplicationId'] = uuid.uuid4().hex
+        return replay_entry
@@ -1,30 +1,129 @@
 import boto3
 from botocore.exceptions import ClientError
+import atexit
 import os
 import json
 import time
+import heapq
+import itertools
+from inflight_tracker import InFlightMessageTracker
+from dead_letter_queue import DeadLetterQueue
+from queue_depth_sampler import QueueDepthSampler
+from enqueue_spool import EnqueueSpool
+import threading
+import zlib
+import hashlib
+import uuid
 
 class DistributedPriorityQueue:
-    def __init__(self):
+    def __init__(self, deadline_ordering=False, prefetch_size=10, track_in_flight=False, payload_validator=None,
+                 depth_refresh_interval=None, shard_selection=None, fifo=None, spool_path=None):
         self.sqs = boto3.client(
             'sqs',
             aws_access_key_id=os.getenv('ACCESS_KEY_ID'),
             aws_secret_access_key=os.getenv('SECRET_ACCESS_KEY'),
             region_name='us-east-2'
         )
-        # Definir URLs de las colas por prioridad
+        # Definir URLs de las colas por prioridad. Cada nivel puede tener varios shards
+        # (URLs separadas por comas) para repartir la carga entre varias colas
         self.priority_queue_urls = {
-            'high': os.getenv('SQS_HIGH_PRIORITY_URL'),
-            'medium': os.getenv('SQS_MEDIUM_PRIORITY_URL'),
-            'low': os.getenv('SQS_LOW_PRIORITY_URL')
+            'high': self._parse_queue_urls(os.getenv('SQS_HIGH_PRIORITY_URL')),
+            'medium': self._parse_queue_urls(os.getenv('SQS_MEDIUM_PRIORITY_URL')),
+            'low': self._parse_queue_urls(os.getenv('SQS_LOW_PRIORITY_URL'))
         }
+        # Consumo de los shards: 'round_robin' o 'depth' (el más cargado primero)
+        self.shard_selection = shard_selection or os.getenv('SQS_SHARD_SELECTION', 'round_robin')
+        self._shard_cursors = {level: itertools.count() for level in self.priority_queue_urls}
+        # Modo FIFO: orden por grupo de mensajes y deduplicación en el broker
+        # (por defecto se activa si todas las colas configuradas son .fifo)
+        if fifo is None:
+            fifo_env = os.getenv('SQS_FIFO_MODE')
+            if fifo_env is not None:
+                fifo = fifo_env.lower() in ('1', 'true', 'yes')
+            else:
+                urls = [url for level in self.priority_queue_urls for url in self.get_queue_urls(level)]
+                fifo = bool(urls) and all(url.endswith('.fifo') for url in urls)
+        self.fifo = fifo
+        # Modo EDF (earliest-deadline-first): se pre-cargan mensajes por nivel
+        # y se entregan ordenados por su deadline dentro de cada nivel
+        self.deadline_ordering = deadline_ordering
+        self.prefetch_size = prefetch_size
+        self._deadline_buffers = {level: [] for level in self.priority_queue_urls}
+        self._buffer_sequence = itertools.count()
+        self._buffer_lock = threading.Lock()
+        # Seguimiento de mensajes en vuelo: la visibilidad se extiende mientras se procesan
+        # y el mensaje solo se elimina al confirmar (ack) su procesamiento
+        self.inflight_tracker = InFlightMessageTracker(self.sqs) if track_in_flight else None
+        # Mensajes venenosos: los que no se pueden decodificar o superan el número máximo
+        # de recepciones se envían a la cola de mensajes muertos con los metadatos del fallo
+        dead_letter_url = os.getenv('SQS_DEAD_LETTER_URL')
+        self.dead_letter_queue = DeadLetterQueue(self.sqs, dead_letter_url) if dead_letter_url else None
+        self.max_receive_count = int(os.getenv('SQS_MAX_RECEIVE_COUNT', '5'))
+        self.payload_validator = payload_validator
+        # receipt_handle -> metadatos de la entrega, hasta que se confirme o libere
+        self._deliveries = {}
+        # Trazador de spans por mensaje (lo asigna el manager; None = sin trazado)
+        self.tracer = None
+        # Muestreo en segundo plano de la profundidad de las colas: empty() lee la caché
+        self.depth_sampler = None
+        if depth_refresh_interval:
+            self.start_depth_sampler(depth_refresh_interval)
+        # Spool local opcional: put() escribe en un log de solo-anexado y un flusher
+        # en segundo plano lo drena a SQS en lotes (tolera caídas de SQS y del proceso).
+        # Se abre con el primer put(), así los procesos que solo consumen no lo tocan;
+        # '{pid}' en la ruta da a cada proceso productor su propio archivo
+        self.spool_path = spool_path or os.getenv('SQS_SPOOL_PATH')
+        self.spool = None
+        self._spool_lock = threading.Lock()
+        if self.spool_path:
+            # Último drenado del spool al salir del proceso
+            atexit.register(self.stop_spool)
 
-    def get_queue_url(self, priority_level):
-        return self.priority_queue_urls.get(priority_level)
+    def _parse_queue_urls(self, value):
+        if not value:
+            return value
+        urls = [url.strip() for url in value.split(',') if url.strip()]
+        return urls if len(urls) > 1 else urls[0]
 
-    def put(self, priority_level, item):
+    def get_queue_urls(self, priority_level):
+        # Lista de shards del nivel (una sola URL equivale a un único shard)
+        urls = self.priority_queue_urls.get(priority_level)
+        if not urls:
+            return []
+        return list(urls) if isinstance(urls, (list, tuple)) else [urls]
+
+    def get_queue_url(self, priority_level, shard_key=None):
+        urls = self.get_queue_urls(priority_level)
+        if not urls:
+            return None
+        if shard_key is None or len(urls) == 1:
+            return urls[0]
+        # Hash estable: los mensajes de un mismo usuario siempre van al mismo shard
+        return urls[zlib.crc32(str(shard_key).encode('utf-8')) % len(urls)]
+
+    def _shard_order(self, priority_level):
+        urls = self.get_queue_urls(priority_level)
+        if len(urls) <= 1:
+            return urls
+        sampler = self.depth_sampler
+        if self.shard_selection == 'depth' and sampler is not None and sampler.is_running():
+            return sorted(urls, key=sampler.shard_depth, reverse=True)
+        # Round-robin: cada lectura empieza por el siguiente shard
+        start = next(self._shard_cursors[priority_level]) % len(urls)
+        return urls[start:] + urls[:start]
+
+    def deduplication_id(self, item):
+        # Id determinista a partir del contenido: el mismo contenido produce el mismo id
+        content = json.dumps(item, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def put(self, priority_level, item, deadline=None, shard_key=None, group_id=None, message_attributes=None):
         try:
-            queue_url = self.get_queue_url(priority_level)
+            if self.fifo:
+                # SQS solo ordena dentro de una cola: todo el grupo debe ir al mismo shard
+                group_id = str(group_id or shard_key or 'default')
+                shard_key = group_id
+            queue_url = self.get_queue_url(priority_level, shard_key)
             if not queue_url:
                 print(f"❌ URL de cola no encontrada para prioridad '{priority_level}'")
                 return
@@ -34,67 +133,381 @@ class DistributedPriorityQueue:
                 'timestamp': str(int(time.time())),
                 'data': item  # item ya contiene los datos necesarios
             }
+            if deadline is not None:
+                # Epoch (segundos) a partir del cual la notificación pierde su utilidad
+                message['deadline'] = deadline
 
-            response = self.sqs.send_message(
-                QueueUrl=queue_url,
-                MessageBody=json.dumps(message),
-                DelaySeconds=0  # Entrega inmediata
-            )
+            if self.spool_path:
+                sequence = self._get_spool().append(
+                    queue_url,
+                    json.dumps(message),
+                    group_id=group_id if self.fifo else None,
+                    deduplication_id=self.deduplication_id(item) if self.fifo else None,
+                    message_attributes=message_attributes
+                )
+                return {'SpoolSequence': sequence}
+
+            params = {'QueueUrl': queue_url, 'MessageBody': json.dumps(message)}
+            if message_attributes:
+                # Atributos del mensaje, p. ej. el contexto de trazado (traceparent)
+                params['MessageAttributes'] = message_attributes
+            if self.fifo:
+                # Las colas FIFO no admiten DelaySeconds por mensaje; el broker descarta
+                # los duplicados con el mismo MessageDeduplicationId dentro de su ventana
+                params['MessageGroupId'] = group_id
+                params['MessageDeduplicationId'] = self.deduplication_id(item)
+            else:
+                params['DelaySeconds'] = 0  # Entrega inmediata
+            response = self.sqs.send_message(**params)
             return response
         except ClientError as e:
             print(f"Error enviando mensaje a SQS: {e}")
             raise
 
     def get(self):
+        message = self.receive()
+        if message is None:
+            return None
+        priority_level, data, receipt_handle = message
+        # get() conserva la semántica original: el mensaje se da por procesado al recibirlo
+        self.ack(receipt_handle)
+        return (priority_level, data)
+
+    def receive(self):
+        # Devuelve (prioridad, datos, receipt_handle). Cada mensaje recibido debe confirmarse
+        # con ack() o devolverse con release(); sin seguimiento de mensajes en vuelo
+        # el mensaje ya se eliminó de SQS al recibirlo
+        if self.deadline_ordering:
+            # Los buffers EDF se comparten entre los workers del mismo proceso
+            return self._receive_earliest_deadline()
+
         # Prioridades en orden descendente
         for priority_level in ['high', 'medium', 'low']:
-            queue_url = self.get_queue_url(priority_level)
+            shards = self._shard_order(priority_level)
+            for shard_index, queue_url in enumerate(shards):
+                message = self._receive_from_shard(priority_level, queue_url, long_poll=shard_index == len(shards) - 1)
+                if message is not None:
+                    return message
+
+        print("❌ No se encontraron mensajes en ninguna cola.")
+        return None
+
+    def _receive_from_shard(self, priority_level, queue_url, long_poll):
+        # Solo el último shard del nivel espera (long polling) para no sumar esperas
+        while True:
             try:
+                visibility_timeout = self._visibility_timeout()
+                dequeued_at = time.time()
                 response = self.sqs.receive_message(
                     QueueUrl=queue_url,
                     MaxNumberOfMessages=1,
-                    WaitTimeSeconds=5,
-                    VisibilityTimeout=30
+                    WaitTimeSeconds=5 if long_poll else 0,
+                    VisibilityTimeout=visibility_timeout,
+                    MessageSystemAttributeNames=['ApproximateReceiveCount', 'MessageGroupId'],
+                    MessageAttributeNames=['All']  # Se conservan al enviar a cuarentena
                 )
 
-                if 'Messages' in response:
-                    msg = response['Messages'][0]
-                    body = json.loads(msg['Body'])
-                    receipt_handle = msg['ReceiptHandle']
-                    # Eliminar el mensaje procesado
+                if 'Messages' not in response:
+                    return None
+
+                msg = response['Messages'][0]
+                receipt_handle = msg['ReceiptHandle']
+                body, disposable = self._accept(queue_url, priority_level, msg, visibility_timeout, dequeued_at)
+                if disposable:
+                    # Eliminar el mensaje procesado (o enviado a cuarentena)
                     self.sqs.delete_message(
                         QueueUrl=queue_url,
                         ReceiptHandle=receipt_handle
                     )
-                    return (priority_level, body['data'])
+                if body is None:
+                    continue  # Mensaje en cuarentena (o pendiente de ella), intentar con el siguiente
+                return (priority_level, body['data'], receipt_handle)
             except ClientError as e:
                 print(f"Error recibiendo mensaje de SQS: {e}")
-                continue  # Intentar con la siguiente cola
+                return None  # Intentar con la siguiente cola
+
+    def release_buffered(self):
+        # Devuelve a SQS los mensajes pre-cargados en los buffers EDF que ya no se
+        # procesarán (p. ej. al drenar un consumidor)
+        with self._buffer_lock:
+            receipt_handles = [entry[4] for buffer in self._deadline_buffers.values() for entry in buffer]
+            for buffer in self._deadline_buffers.values():
+                buffer.clear()
+        for receipt_handle in receipt_handles:
+            delivery = self._deliveries.pop(receipt_handle, None)
+            if self.inflight_tracker:
+                # Sin pasar por release(): no cuenta como fallo ni puede ir a cuarentena
+                self.inflight_tracker.release(receipt_handle)
+            elif delivery:
+                # Sin seguimiento el mensaje se eliminó al pre-cargarlo: se vuelve a enviar
+                self._resend(delivery)
+        if receipt_handles:
+            print(f"↩️ {len(receipt_handles)} mensajes pre-cargados devueltos a SQS")
+        return len(receipt_handles)
+
+    def _resend(self, delivery):
+        params = {'QueueUrl': delivery['queue_url'], 'MessageBody': delivery['raw_body']}
+        if delivery['message_attributes']:
+            params['MessageAttributes'] = delivery['message_attributes']
+        if delivery['queue_url'].endswith('.fifo'):
+            # Un id nuevo: el original haría que SQS descartara el re-envío por duplicado
+            params['MessageGroupId'] = delivery['group_id'] or 'default'
+            params['MessageDeduplicationId'] = uuid.uuid4().hex
+        try:
+            self.sqs.send_message(**params)
+        except ClientError as e:
+            print(f"Error devolviendo mensaje pre-cargado a SQS: {e}")
+
+    def get_trace_context(self, receipt_handle):
+        delivery = self._deliveries.get(receipt_handle)
+        return delivery['trace_context'] if delivery else None
+
+    def ack(self, receipt_handle):
+        self._deliveries.pop(receipt_handle, None)
+        if self.inflight_tracker and receipt_handle is not None:
+            self.inflight_tracker.complete(receipt_handle)
+
+    def release(self, receipt_handle, error=None):
+        delivery = self._deliveries.pop(receipt_handle, None)
+        if delivery is None:
+            return
+
+        can_retry = delivery['receive_count'] < self.max_receive_count or not self.dead_letter_queue
+        if self.inflight_tracker and can_retry:
+            self.inflight_tracker.release(receipt_handle)
+            return
+
+        # El mensaje ya no se puede reintentar (fue eliminado al recibirlo o agotó sus recepciones)
+        quarantined = False
+        if self.dead_letter_queue:
+            quarantined = self.dead_letter_queue.quarantine(
+                delivery['queue_url'],
+                delivery['priority_level'],
+                delivery['raw_body'],
+                reason='processing_failed',
+                receive_count=delivery['receive_count'],
+                error=error,
+                group_id=delivery['group_id'],
+                message_attributes=delivery['message_attributes']
+            )
+        if not self.inflight_tracker:
+            if not quarantined:
+                print(f"❌ Mensaje de la cola '{delivery['priority_level']}' descartado tras fallar: {error}")
+            return
+        if quarantined:
+            self.inflight_tracker.discard(receipt_handle)
+            self.sqs.delete_message(QueueUrl=delivery['queue_url'], ReceiptHandle=receipt_handle)
+        else:
+            self.inflight_tracker.release(receipt_handle)
+
+    def replay_dead_letters(self, max_messages=None, priority_level=None):
+        if not self.dead_letter_queue:
+            print("❌ No hay una cola de mensajes muertos configurada.")
+            return 0
+        return self.dead_letter_queue.replay(max_messages=max_messages, priority_level=priority_level)
+
+    def _accept(self, queue_url, priority_level, msg, visibility_timeout, dequeued_at=None):
+        # Decodifica y valida un mensaje recibido; los mensajes venenosos van a cuarentena.
+        # Devuelve (cuerpo o None, si el mensaje se puede eliminar ya de la cola de origen)
+        raw_body = msg['Body']
+        receive_count = int(msg.get('Attributes', {}).get('ApproximateReceiveCount', 1))
+        group_id = msg.get('Attributes', {}).get('MessageGroupId')
+        message_attributes = msg.get('MessageAttributes')
+        reason, error, body = None, None, None
+        # Spans de dequeue y decode, enlazados con el productor mediante el traceparent
+        tracer = self.tracer if self.tracer is not None and self.tracer.enabled else None
+        trace_context = None
+        if tracer:
+            trace_context = tracer.extract(msg.get('MessageAttributes'))
+            decode_started = time.time()
+            tracer.record('dequeue', trace_context, dequeued_at or decode_started, decode_started,
+                          priority_level=priority_level)
+
+        if self.dead_letter_queue and receive_count > self.max_receive_count:
+            reason = 'max_receives_exceeded'
+        else:
+            try:
+                body = json.loads(raw_body)
+                if 'data' not in body:
+                    raise KeyError('data')
+                if self.payload_validator:
+                    self.payload_validator(body['data'])
+            except (ValueError, KeyError, TypeError) as e:
+                reason, error = 'decode_error', str(e)
+        if tracer:
+            tracer.record('decode', trace_context, decode_started, time.time(), error=error)
+
+        if reason:
+            if not self.dead_letter_queue:
+                print(f"❌ Mensaje inválido descartado de la cola '{priority_level}': {error}")
+                return None, True
+            quarantined = self.dead_letter_queue.quarantine(queue_url, priority_level, raw_body, reason, receive_count,
+                                                            error, group_id=group_id, message_attributes=message_attributes)
+            if not quarantined:
+                # No se elimina: SQS lo vuelve a entregar al vencer su visibilidad y se reintenta la cuarentena
+                print(f"⚠️ Mensaje de la cola '{priority_level}' conservado hasta poder enviarlo a cuarentena")
+            return None, quarantined
+
+        receipt_handle = msg['ReceiptHandle']
+        self._deliveries[receipt_handle] = {
+            'queue_url': queue_url,
+            'priority_level': priority_level,
+            'raw_body': raw_body,
+            'receive_count': receive_count,
+            'group_id': group_id,
+            'message_attributes': message_attributes,
+            'trace_context': trace_context
+        }
+        if self.inflight_tracker:
+            # El mensaje se elimina con ack() cuando termine su procesamiento
+            self.inflight_tracker.track(queue_url, receipt_handle, visibility_timeout)
+        return body, not self.inflight_tracker
+
+    def _visibility_timeout(self):
+        if self.inflight_tracker:
+            return self.inflight_tracker.initial_timeout()
+        return 30
+
+    def _receive_earliest_deadline(self):
+        # Prioridades en orden descendente; dentro de cada nivel gana el deadline más cercano
+        for priority_level in ['high', 'medium', 'low']:
+            buffer = self._deadline_buffers[priority_level]
+            with self._buffer_lock:
+                needs_refill = len(buffer) < self.prefetch_size
+                buffered = bool(buffer)
+            if needs_refill:
+                # La recarga (con long polling) se hace fuera del lock para no serializar
+                # a los workers; si ya hay mensajes en el buffer no se espera por más
+                self._prefetch(priority_level, wait_seconds=0 if buffered else 5)
+            with self._buffer_lock:
+                if buffer:
+                    _, _, _, data, receipt_handle = heapq.heappop(buffer)
+                    return (priority_level, data, receipt_handle)
 
         print("❌ No se encontraron mensajes en ninguna cola.")
         return None
 
+    def _prefetch(self, priority_level, wait_seconds):
+        shards = self._shard_order(priority_level)
+        buffer = self._deadline_buffers[priority_level]
+        for shard_index, queue_url in enumerate(shards):
+            if len(buffer) >= self.prefetch_size:
+                break
+            self._prefetch_shard(priority_level, queue_url, wait_seconds if shard_index == len(shards) - 1 else 0)
+
+    def _prefetch_shard(self, priority_level, queue_url, wait_seconds):
+        buffer = self._deadline_buffers[priority_level]
+        try:
+            visibility_timeout = self._visibility_timeout()
+            dequeued_at = time.time()
+            response = self.sqs.receive_message(
+                QueueUrl=queue_url,
+                MaxNumberOfMessages=max(1, min(10, self.prefetch_size - len(buffer))),
+                WaitTimeSeconds=wait_seconds,
+                VisibilityTimeout=visibility_timeout,
+                MessageSystemAttributeNames=['ApproximateReceiveCount', 'MessageGroupId'],
+                MessageAttributeNames=['All']  # Se conservan al enviar a cuarentena
+            )
+            messages = response.get('Messages', [])
+            if not messages:
+                return
+
+            to_delete = []
+            for msg in messages:
+                # Los mensajes en el buffer también reciben heartbeats de visibilidad
+                body, disposable = self._accept(queue_url, priority_level, msg, visibility_timeout, dequeued_at)
+                if disposable:
+                    to_delete.append(msg['ReceiptHandle'])
+                if body is None:
+                    continue
+                # Los mensajes sin deadline se atienden después de los que sí lo tienen
+                deadline = body.get('deadline', float('inf'))
+                with self._buffer_lock:
+                    heapq.heappush(buffer, (deadline, body.get('timestamp', ''), next(self._buffer_sequence), body['data'], msg['ReceiptHandle']))
+
+            if not to_delete:
+                return
+
+            # Eliminar los mensajes pre-cargados (o en cuarentena) en un solo lote
+            self.sqs.delete_message_batch(
+                QueueUrl=queue_url,
+                Entries=[
+                    {'Id': str(i), 'ReceiptHandle': receipt_handle}
+                    for i, receipt_handle in enumerate(to_delete)
+                ]
+            )
+        except ClientError as e:
+            print(f"Error recibiendo mensaje de SQS: {e}")
+
+    def start_depth_sampler(self, refresh_interval=5):
+        if self.depth_sampler is None:
+            shards = {level: self.get_queue_urls(level) for level in self.priority_queue_urls}
+            self.depth_sampler = QueueDepthSampler(self.sqs, shards, refresh_interval)
+        self.depth_sampler.start()
+        return self.depth_sampler
+
+    def get_spool_stats(self):
+        if not self.spool:
+            return None
+        return self.spool.get_stats()
+
+    def _get_spool(self):
+        with self._spool_lock:
+            if self.spool is None:
+                self.spool = EnqueueSpool(
+                    self.sqs,
+                    self.spool_path.format(pid=os.getpid()),
+                    sync_interval=int(os.getenv('SQS_SPOOL_SYNC_MS', '50')) / 1000
+                )
+                self.spool.start()
+            return self.spool
+
+    def stop_spool(self):
+        with self._spool_lock:
+            spool, self.spool = self.spool, None
+        if spool:
+            spool.stop()
+
+    def stop_depth_sampler(self):
+        if self.depth_sampler is not None:
+            self.depth_sampler.stop()
+
     def empty(self):
+        if any(self._deadline_buffers.values()):
+            return False
+
+        if self.spool and self.spool.depth():
+            return False  # Aún hay mensajes en el spool local sin enviar
+
+        if self.depth_sampler is not None and self.depth_sampler.is_running():
+            return self.depth_sampler.depth() == 0
+
         total_messages = 0
         for priority_level in ['high', 'medium', 'low']:
-            queue_url = self.get_queue_url(priority_level)
-            try:
-                response = self.sqs.get_queue_attributes(
-                    QueueUrl=queue_url,
-                    AttributeNames=['ApproximateNumberOfMessages']
-                )
-                num_messages = int(response['Attributes']['ApproximateNumberOfMessages'])
-                total_messages += num_messages
-            except ClientError as e:
-                print(f"Error comprobando estado de la cola {priority_level}: {e}")
+            for queue_url in self.get_queue_urls(priority_level):
+                try:
+                    response = self.sqs.get_queue_attributes(
+                        QueueUrl=queue_url,
+                        AttributeNames=['ApproximateNumberOfMessages']
+                    )
+                    num_messages = int(response['Attributes']['ApproximateNumberOfMessages'])
+                    total_messages += num_messages
+                except ClientError as e:
+                    print(f"Error comprobando estado de la cola {priority_level}: {e}")
         return total_messages == 0
 
     def purge(self):
+        for buffer in self._deadline_buffers.values():
+            for entry in buffer:
+                self._deliveries.pop(entry[-1], None)
+                if self.inflight_tracker:
+                    self.inflight_tracker.discard(entry[-1])
+            buffer.clear()
         for priority_level in ['high', 'medium', 'low']:
-            queue_url = self.get_queue_url(priority_level)
-            try:
-                self.sqs.purge_queue(QueueUrl=queue_url)
-                print(f"✅ Cola SQS '{priority_level}' purgada exitosamente.")
-                time.sleep(1)  # Pequeño delay entre purgas
-            except ClientError as e:
-                print(f"Error purgando la cola SQS '{priority_level}': {e}")
+            for queue_url in self.get_queue_urls(priority_level):
+                try:
+                    self.sqs.purge_queue(QueueUrl=queue_url)
+                    print(f"✅ Cola SQS '{priority_level}' purgada exitosamente.")
+                    time.sleep(1)  # Pequeño delay entre purgas
+                except ClientError as e:
+                    print(f"Error purgando la cola SQS '{priority_level}': {e}")
@@ -0,0 +1,207 @@
+from botocore.exceptions import ClientError
+from collections import OrderedDict
+import fcntl
+import itertools
+import json
+import os
+import threading
+import time
+
+class EnqueueSpool:
+    def __init__(self, sqs_client, path, sync_interval=0.05, batch_size=10, max_log_bytes=16 * 1024 * 1024):
+        self.sqs = sqs_client
+        self.path = path
+        self.sync_interval = sync_interval  # Cada cuánto se hace fsync del lote y se drena hacia SQS
+        self.batch_size = min(batch_size, 10)  # Límite de send_message_batch
+        self.max_log_bytes = max_log_bytes  # Tamaño a partir del cual se compacta el log
+        # secuencia -> entrada aún no aceptada por SQS, en orden de llegada
+        self._pending = OrderedDict()
+        self._done_since_compaction = 0
+        self._dirty = False  # Hay escrituras en el log sin fsync
+        self._file = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._wake_event = threading.Event()
+        self._thread = None
+        self._backoff = 0
+        self.stats = {'appended': 0, 'flushed': 0, 'failed': 0, 'dropped': 0, 'fsyncs': 0, 'recovered': 0}
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Un solo proceso por archivo: otro spool recuperaría y reenviaría las entradas
+        # de este, y al compactar dejaría a este escribiendo en un archivo ya reemplazado
+        self._lock_file = open(f"{path}.lock", 'w')
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._lock_file.close()
+            raise RuntimeError(f"Spool {path} is already in use by another process")
+        self._recover()
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        # Último drenado antes de cerrar; lo que no se pueda enviar queda en disco
+        self._stop_event.set()
+        self._wake_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        with self._lock:
+            self._file.close()
+        self._lock_file.close()  # Libera el flock
+
+    def append(self, queue_url, body, group_id=None, deduplication_id=None, message_attributes=None):
+        with self._lock:
+            record = {'seq': next(self._sequence), 'queue_url': queue_url, 'body': body, 'enqueued_at': time.time()}
+            if group_id is not None:
+                record['group_id'] = group_id
+                record['deduplication_id'] = deduplication_id
+            if message_attributes:
+                record['attributes'] = message_attributes
+            self._file.write(json.dumps(record) + '\n')
+            self._file.flush()  # Llega al sistema operativo; el fsync se agrupa en el flusher
+            self._dirty = True
+            self._pending[record['seq']] = record
+            self.stats['appended'] += 1
+            if len(self._pending) >= self.batch_size and not self._backoff:
+                self._wake_event.set()  # Lote completo: no esperar al intervalo
+        return record['seq']
+
+    def flush(self):
+        # Un fsync por lote y envío a SQS en lotes de hasta 10 mensajes por cola
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending and not self._dirty:
+                    return 0  # Spool ocioso: nada que sincronizar ni enviar
+                dirty, self._dirty = self._dirty, False
+                fileno = self._file.fileno()
+                batches = {}
+                for record in self._pending.values():
+                    batches.setdefault(record['queue_url'], []).append(record)
+            if dirty:
+                os.fsync(fileno)
+                self.stats['fsyncs'] += 1
+
+            sent = 0
+            for queue_url, records in batches.items():
+                for start in range(0, len(records), self.batch_size):
+                    sent += self._send_batch(queue_url, records[start:start + self.batch_size])
+
+            with self._lock:
+                oversized = self._file.tell() > self.max_log_bytes
+                if oversized and self._done_since_compaction > len(self._pending):
+                    self._rewrite()
+            return sent
+
+    def depth(self):
+        with self._lock:
+            return len(self._pending)
+
+    def flush_lag(self):
+        # Antigüedad en segundos de la entrada más vieja que SQS aún no aceptó
+        with self._lock:
+            if not self._pending:
+                return 0.0
+            return time.time() - next(iter(self._pending.values()))['enqueued_at']
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['depth'] = self.depth()
+        stats['flush_lag'] = self.flush_lag()
+        return stats
+
+    def _send_batch(self, queue_url, records):
+        entries = []
+        for record in records:
+            entry = {'Id': str(record['seq']), 'MessageBody': record['body']}
+            if 'group_id' in record:
+                entry['MessageGroupId'] = record['group_id']
+                entry['MessageDeduplicationId'] = record['deduplication_id']
+            if 'attributes' in record:
+                entry['MessageAttributes'] = record['attributes']
+            entries.append(entry)
+        try:
+            response = self.sqs.send_message_batch(QueueUrl=queue_url, Entries=entries)
+        except ClientError as e:
+            print(f"❌ Error drenando el spool hacia SQS: {e}")
+            self.stats['failed'] += len(records)
+            return 0
+
+        done = [int(entry['Id']) for entry in response.get('Successful', [])]
+        sent = len(done)
+        for failure in response.get('Failed', []):
+            if failure.get('SenderFault'):
+                # SQS nunca aceptará este mensaje: reintentarlo bloquearía el spool
+                print(f"❌ Mensaje {failure['Id']} del spool descartado por SQS: {failure.get('Message')}")
+                done.append(int(failure['Id']))
+                self.stats['dropped'] += 1
+            else:
+                self.stats['failed'] += 1
+
+        with self._lock:
+            for sequence in done:
+                self._pending.pop(sequence, None)
+                self._file.write(json.dumps({'seq': sequence, 'done': True}) + '\n')
+            self._file.flush()
+            if done:
+                self._dirty = True  # Las marcas de enviado se sincronizan en el próximo flush
+            self._done_since_compaction += len(done)
+        self.stats['flushed'] += sent
+        return sent
+
+    def _recover(self):
+        # Reconstruir las entradas que SQS no llegó a aceptar antes de una caída
+        last_sequence = 0
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as log:
+                for line in log:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # Última línea truncada por la caída
+                    last_sequence = max(last_sequence, record['seq'])
+                    if record.get('done'):
+                        self._pending.pop(record['seq'], None)
+                    else:
+                        self._pending[record['seq']] = record
+        self._sequence = itertools.count(last_sequence + 1)
+        self.stats['recovered'] = len(self._pending)
+        self._rewrite()
+        if self._pending:
+            print(f"♻️ {len(self._pending)} mensajes recuperados del spool local")
+
+    def _rewrite(self):
+        # Compactar: el log se reescribe solo con las entradas pendientes
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as log:
+            for record in self._pending.values():
+                log.write(json.dumps(record) + '\n')
+            log.flush()
+            os.fsync(log.fileno())
+        os.replace(temp_path, self.path)
+        if self._file is not None:
+            self._file.close()
+        self._file = open(self.path, 'a', encoding='utf-8')
+        self._done_since_compaction = 0
+        self._dirty = False  # El log compactado ya está sincronizado
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            self._wake_event.wait(self.sync_interval + self._backoff)
+            self._wake_event.clear()
+            pending = self.depth()
+            try:
+                sent = self.flush()
+            except Exception as e:
+                print(f"❌ Error en el flusher del spool: {e}")
+                sent = 0
+            # Con SQS caído se espera cada vez más entre intentos (hasta 30 s)
+            self._backoff = min(max(self._backoff * 2, 1), 30) if pending and not sent else 0
@@ -0,0 +1,81 @@
+from collections import OrderedDict
+import threading
+import time
+
+class FollowerSetCache:
+    def __init__(self, max_followers=100000, ttl=300):
+        # Límite de memoria expresado en seguidores cacheados entre todos los salones
+        self.max_followers = max_followers
+        self.ttl = ttl  # Red de seguridad ante cambios que no pasen por este proceso
+        # salón -> (expira_en, {user_id: email}), en orden LRU
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'updates': 0}
+
+    def get(self, beauty_salon_id):
+        with self._lock:
+            entry = self._entries.get(beauty_salon_id)
+            if entry is None or entry[0] < time.time():
+                if entry is not None:
+                    self._drop(beauty_salon_id)
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(beauty_salon_id)
+            self.stats['hits'] += 1
+            return list(entry[1].items())
+
+    def put(self, beauty_salon_id, followers):
+        followers = dict(followers)
+        with self._lock:
+            if beauty_salon_id in self._entries:
+                self._drop(beauty_salon_id)
+            if len(followers) > self.max_followers:
+                return  # No cabe en el presupuesto de memoria
+            self._entries[beauty_salon_id] = (time.time() + self.ttl, followers)
+            self._size += len(followers)
+            self._evict()
+
+    def add(self, beauty_salon_id, user_id, email):
+        # Actualización incremental: solo se aplica si el salón ya está en caché
+        with self._lock:
+            entry = self._entries.get(beauty_salon_id)
+            if entry is None:
+                return
+            if user_id not in entry[1]:
+                self._size += 1
+            entry[1][user_id] = email
+            self.stats['updates'] += 1
+            self._evict()
+
+    def remove(self, beauty_salon_id, user_id):
+        with self._lock:
+            entry = self._entries.get(beauty_salon_id)
+            if entry is None or user_id not in entry[1]:
+                return
+            del entry[1][user_id]
+            self._size -= 1
+            self.stats['updates'] += 1
+
+    def invalidate(self, beauty_salon_id=None):
+        with self._lock:
+            if beauty_salon_id is None:
+                self._entries.clear()
+                self._size = 0
+            elif beauty_salon_id in self._entries:
+                self._drop(beauty_salon_id)
+
+    def size(self):
+        with self._lock:
+            return self._size
+
+    def _drop(self, beauty_salon_id):
+        _, followers = self._entries.pop(beauty_salon_id)
+        self._size -= len(followers)
+
+    def _evict(self):
+        # Expulsar los salones usados hace más tiempo hasta volver al presupuesto
+        while self._size > self.max_followers and self._entries:
+            beauty_salon_id = next(iter(self._entries))
+            self._drop(beauty_salon_id)
+            self.stats['evictions'] += 1
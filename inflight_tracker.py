@@ -0,0 +1,145 @@
+from botocore.exceptions import ClientError
+from collections import deque
+import math
+import threading
+import time
+
+class InFlightMessageTracker:
+    def __init__(self, sqs_client, default_timeout=30, min_timeout=10, max_timeout=43200,
+                 heartbeat_interval=10, percentile=0.95, safety_factor=1.5, min_samples=20):
+        self.sqs = sqs_client
+        self.default_timeout = default_timeout
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout  # SQS no permite más de 12 horas
+        self.heartbeat_interval = heartbeat_interval
+        self.percentile = percentile
+        self.safety_factor = safety_factor
+        self.min_samples = min_samples
+        # receipt_handle -> {'queue_url', 'received_at', 'visible_at'}
+        self._in_flight = {}
+        self._durations = deque(maxlen=500)
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._heartbeat_thread = None
+        self.stats = {'extended': 0, 'released': 0, 'completed': 0, 'lost': 0}
+
+    def initial_timeout(self):
+        # Nunca por debajo de tres latidos: así un heartbeat siempre alcanza a extender
+        # la visibilidad antes de que expire, aunque la cola sea muy rápida
+        floor = max(self.min_timeout, self.heartbeat_interval * 3)
+        # Mientras no haya suficientes muestras se usa el timeout por defecto
+        with self._lock:
+            samples = sorted(self._durations)
+        if len(samples) < self.min_samples:
+            return max(floor, self.default_timeout)
+        index = min(len(samples) - 1, math.ceil(self.percentile * len(samples)) - 1)
+        timeout = math.ceil(samples[index] * self.safety_factor)
+        return max(floor, min(self.max_timeout, timeout))
+
+    def track(self, queue_url, receipt_handle, visibility_timeout):
+        now = time.time()
+        with self._lock:
+            self._in_flight[receipt_handle] = {
+                'queue_url': queue_url,
+                'received_at': now,
+                'visible_at': now + visibility_timeout
+            }
+        self._ensure_heartbeat()
+
+    def complete(self, receipt_handle):
+        entry = self._forget(receipt_handle)
+        if entry is None:
+            return
+        with self._lock:
+            self._durations.append(time.time() - entry['received_at'])
+        self.stats['completed'] += 1
+        try:
+            self.sqs.delete_message(QueueUrl=entry['queue_url'], ReceiptHandle=receipt_handle)
+        except ClientError as e:
+            print(f"Error eliminando mensaje de SQS: {e}")
+
+    def release(self, receipt_handle):
+        # Devolver el mensaje a la cola de inmediato para que otro worker lo tome
+        entry = self._forget(receipt_handle)
+        if entry is None:
+            return
+        self.stats['released'] += 1
+        try:
+            self.sqs.change_message_visibility(
+                QueueUrl=entry['queue_url'],
+                ReceiptHandle=receipt_handle,
+                VisibilityTimeout=0
+            )
+        except ClientError as e:
+            print(f"Error liberando mensaje de SQS: {e}")
+
+    def discard(self, receipt_handle):
+        # Dejar de seguir un mensaje sin tocarlo en SQS (p. ej. tras purgar la cola)
+        self._forget(receipt_handle)
+
+    def in_flight_count(self):
+        with self._lock:
+            return len(self._in_flight)
+
+    def heartbeat(self):
+        # Extender la visibilidad de los mensajes que expiran antes del próximo latido
+        now = time.time()
+        extension = self.initial_timeout()
+        due = {}
+        with self._lock:
+            for receipt_handle, entry in self._in_flight.items():
+                if entry['visible_at'] - now <= self.heartbeat_interval * 2:
+                    due.setdefault(entry['queue_url'], []).append(receipt_handle)
+
+        for queue_url, handles in due.items():
+            # change_message_visibility_batch acepta como máximo 10 entradas
+            for start in range(0, len(handles), 10):
+                chunk = handles[start:start + 10]
+                try:
+                    response = self.sqs.change_message_visibility_batch(
+                        QueueUrl=queue_url,
+                        Entries=[
+                            {'Id': str(i), 'ReceiptHandle': handle, 'VisibilityTimeout': extension}
+                            for i, handle in enumerate(chunk)
+                        ]
+                    )
+                except ClientError as e:
+                    print(f"Error extendiendo visibilidad en SQS: {e}")
+                    continue
+
+                failed = {int(failure['Id']) for failure in response.get('Failed', [])}
+                with self._lock:
+                    for i, handle in enumerate(chunk):
+                        if i in failed:
+                            # El receipt ya no es válido: el mensaje se perdió para este worker
+                            self._in_flight.pop(handle, None)
+                            self.stats['lost'] += 1
+                        elif handle in self._in_flight:
+                            self._in_flight[handle]['visible_at'] = now + extension
+                            self.stats['extended'] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        if self._heartbeat_thread is not None:
+            self._heartbeat_thread.join()
+            self._heartbeat_thread = None
+
+    def _forget(self, receipt_handle):
+        if receipt_handle is None:
+            return None
+        with self._lock:
+            return self._in_flight.pop(receipt_handle, None)
+
+    def _ensure_heartbeat(self):
+        if self._heartbeat_thread is not None and self._heartbeat_thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._heartbeat_thread = threading.Thread(target=self._heartbeat_loop, daemon=True)
+        self._heartbeat_thread.start()
+
+    def _heartbeat_loop(self):
+        while not self._stop_event.wait(self.heartbeat_interval):
+            try:
+                self.heartbeat()
+            except Exception as e:
+                print(f"❌ Error en heartbeat de visibilidad: {e}")
@@ -0,0 +1,142 @@
+from collections import OrderedDict
+import string
+import threading
+
+DEFAULT_TEMPLATES = {
+    'Offer': (
+        "New Offer Available",
+        "Hello {user_id},\n\nBeauty salon {beauty_salon_id} has a new offer: {description}."
+    ),
+    'Reminder': (
+        "Appointment Reminder",
+        "Hello {user_id},\n\nThis is a reminder for your appointment at beauty salon {beauty_salon_id} on {date} at {time} for {service}."
+    ),
+    'OfferDigest': (
+        "New Offers Available",
+        "Hello {user_id},\n\nBeauty salon {beauty_salon_id} has {offer_count} new offers:\n{offers}"
+    ),
+    'Unsubscription': (
+        "Unsubscription Confirmation",
+        "Hello {user_id},\n\nYou have successfully unsubscribed from beauty salon {beauty_salon_id}."
+    )
+}
+
+class CompiledTemplate:
+    def __init__(self, subject, body):
+        # Se traduce cada plantilla a una f-string compilada una sola vez
+        self.fields = set()
+        self._render_subject = self._compile(subject)
+        self._render_body = self._compile(body)
+
+    def render(self, context):
+        return self._render_subject(context), self._render_body(context)
+
+    def _compile(self, source):
+        parts = []
+        for literal, field_name, format_spec, conversion in string.Formatter().parse(source):
+            if literal:
+                parts.append(repr(literal))
+            if field_name is None:
+                continue
+            if not field_name.isidentifier():
+                raise ValueError(f"Invalid template field: {field_name!r}")
+            if format_spec and any(char in format_spec for char in '{}"\\'):
+                raise ValueError(f"Invalid format spec for field {field_name!r}")
+            self.fields.add(field_name)
+            # Los campos que faltan se renderizan vacíos en lugar de lanzar KeyError
+            expression = f"c.get('{field_name}', '')"
+            if conversion:
+                expression += f"!{conversion}"
+            if format_spec:
+                expression += f":{format_spec}"
+            parts.append('f"{' + expression + '}"')
+        try:
+            code = compile(f"lambda c: {' '.join(parts) or repr('')}", '<template>', 'eval')
+        except SyntaxError as e:
+            raise ValueError(f"Invalid template: {source!r}") from e
+        return eval(code, {'__builtins__': {}})
+
+class MessageTemplateRegistry:
+    def __init__(self, max_cached=1024, max_resolved=100000):
+        self.max_cached = max_cached
+        self.max_resolved = max_resolved
+        # (tipo, salón, locale) -> (asunto, cuerpo) tal como se registraron
+        self._sources = {}
+        # (tipo, salón, locale) pedido -> clave de la plantilla registrada que le corresponde.
+        # Muchos salones comparten la misma plantilla y no deben compilarla cada uno
+        self._resolved = {}
+        # clave registrada -> CompiledTemplate, con expulsión LRU
+        self._compiled = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        for notification_type, (subject, body) in DEFAULT_TEMPLATES.items():
+            self.register(notification_type, subject, body)
+
+    def register(self, notification_type, subject, body, beauty_salon_id=None, locale=None):
+        CompiledTemplate(subject, body)  # Falla al registrar si la plantilla es inválida
+        source_key = (notification_type, beauty_salon_id, locale)
+        with self._lock:
+            self._sources[source_key] = (subject, body)
+            self._compiled.pop(source_key, None)
+            # Las resoluciones de ese tipo podrían apuntar ahora a la nueva plantilla
+            for key in [key for key in self._resolved if key[0] == notification_type]:
+                del self._resolved[key]
+
+    def get(self, notification_type, beauty_salon_id=None, locale=None):
+        key = (notification_type, beauty_salon_id, locale)
+        # Camino rápido sin lock: las operaciones de dict y OrderedDict son atómicas bajo el GIL
+        source_key = self._resolved.get(key)
+        if source_key is not None:
+            compiled = self._compiled.get(source_key)
+            if compiled is not None:
+                try:
+                    self._compiled.move_to_end(source_key)
+                except KeyError:
+                    pass  # Expulsada por otro hilo entre la lectura y la actualización
+                self.stats['hits'] += 1
+                return compiled
+
+        with self._lock:
+            source_key = self._resolve(notification_type, beauty_salon_id, locale)
+            if len(self._resolved) >= self.max_resolved:
+                self._resolved.clear()  # Resolver de nuevo es barato; solo acota la memoria
+            self._resolved[key] = source_key
+            compiled = self._compiled.get(source_key)
+            if compiled is not None:
+                self._compiled.move_to_end(source_key)
+                self.stats['hits'] += 1
+                return compiled
+            self.stats['misses'] += 1
+            compiled = CompiledTemplate(*self._sources[source_key])
+            self._compiled[source_key] = compiled
+            if len(self._compiled) > self.max_cached:
+                self._compiled.popitem(last=False)
+                self.stats['evictions'] += 1
+            return compiled
+
+    def render(self, notification_type, beauty_salon_id=None, locale=None, **context):
+        context['beauty_salon_id'] = beauty_salon_id
+        return self.get(notification_type, beauty_salon_id, locale).render(context)
+
+    def render_many(self, notification_type, contexts, beauty_salon_id=None, locale=None):
+        # La plantilla se resuelve una sola vez para todo el lote
+        compiled = self.get(notification_type, beauty_salon_id, locale)
+        results = []
+        for context in contexts:
+            context = dict(context)
+            context['beauty_salon_id'] = beauty_salon_id
+            results.append(compiled.render(context))
+        return results
+
+    def _resolve(self, notification_type, beauty_salon_id, locale):
+        # Del más específico al más general: salón+locale, salón, locale, por defecto
+        candidates = [
+            (notification_type, beauty_salon_id, locale),
+            (notification_type, beauty_salon_id, None),
+            (notification_type, None, locale),
+            (notification_type, None, None)
+        ]
+        for candidate in candidates:
+            if candidate in self._sources:
+                return candidate
+        raise KeyError(f"No template registered for {notification_type}")
@@ -0,0 +1,119 @@
+from collections import deque
+import json
+import os
+import secrets
+import threading
+import time
+
+class _NoopSpan:
+    # Span compartido cuando el trazado está desactivado: no mide ni reserva nada
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+_NOOP_SPAN = _NoopSpan()
+
+class _Span:
+    def __init__(self, tracer, name, context, args):
+        self.tracer = tracer
+        self.name = name
+        self.parent = context
+        self.args = args
+
+    def __enter__(self):
+        self.parent = self.parent or self.tracer.current_context()
+        self.context = self.tracer._child_context(self.parent)
+        self.tracer._stack().append(self.context)
+        self.start = time.time()
+        return self.context
+
+    def __exit__(self, exc_type, exc, traceback):
+        end = time.time()
+        self.tracer._stack().pop()
+        if exc is not None:
+            self.args['error'] = str(exc)
+        self.tracer._append(self.name, self.context, self.parent, self.start, end, self.args)
+        return False
+
+class MessageTracer:
+    def __init__(self, output_path=None, enabled=None, max_events=100000):
+        # Exportación en formato Chrome Trace Event (chrome://tracing, Perfetto).
+        # '{pid}' en la ruta se sustituye para que cada proceso escriba su archivo
+        self.output_path = output_path
+        self.enabled = bool(output_path) if enabled is None else enabled
+        self._events = deque(maxlen=max_events)  # Se descartan los spans más antiguos
+        self._local = threading.local()
+
+    def span(self, name, context=None, **args):
+        if not self.enabled:
+            return _NOOP_SPAN
+        return _Span(self, name, context, args)
+
+    def record(self, name, context, start, end, **args):
+        # Span ya terminado, para tramos cuyo contexto se conoce al final (p. ej. el dequeue)
+        if not self.enabled:
+            return None
+        parent = context or self.current_context()
+        span_context = self._child_context(parent)
+        self._append(name, span_context, parent, start, end, args)
+        return span_context
+
+    def current_context(self):
+        stack = self._stack()
+        return stack[-1] if stack else None
+
+    def inject(self, context):
+        # Contexto W3C traceparent como atributo del mensaje de SQS
+        if not context:
+            return None
+        return {
+            'traceparent': {
+                'DataType': 'String',
+                'StringValue': f"00-{context['trace_id']}-{context['span_id']}-01"
+            }
+        }
+
+    def extract(self, message_attributes):
+        value = (message_attributes or {}).get('traceparent', {}).get('StringValue', '')
+        parts = value.split('-')
+        if len(parts) != 4:
+            return None
+        return {'trace_id': parts[1], 'span_id': parts[2]}
+
+    def export(self, path=None):
+        path = path or self.output_path
+        if not path:
+            return None
+        path = path.format(pid=os.getpid())
+        events = list(self._events)
+        with open(path, 'w', encoding='utf-8') as output:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, output)
+        print(f"🧭 {len(events)} spans exportados a {path}")
+        return path
+
+    def _child_context(self, parent):
+        trace_id = parent['trace_id'] if parent else secrets.token_hex(16)
+        return {'trace_id': trace_id, 'span_id': secrets.token_hex(8)}
+
+    def _append(self, name, context, parent, start, end, args):
+        args = dict(args, trace_id=context['trace_id'], span_id=context['span_id'])
+        if parent:
+            args['parent_id'] = parent['span_id']
+        self._events.append({
+            'name': name,
+            'cat': 'notification',
+            'ph': 'X',  # Evento completo: inicio y duración en microsegundos
+            'ts': int(start * 1000000),
+            'dur': int((end - start) * 1000000),
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'args': args
+        })
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
@@ -5,6 +5,14 @@ from dotenv import load_dotenv
 from botocore.exceptions import ClientError
 from botocore.config import Config
 import time  
+import heapq
+from collections import OrderedDict
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from message_templates import MessageTemplateRegistry
+from follower_cache import FollowerSetCache
+from message_tracer import MessageTracer
 
 # Cargar las variables de entorno desde el archivo .env
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '.env'))
@@ -27,6 +35,34 @@ class NotificationManager:
             config=self.config
         )
         self.table_name = 'notifications'
+        # Índice disperso: solo contiene las notificaciones pendientes y activas
+        self.pending_index_name = 'PendingTypeSalon-Timestamp-index'
+        # Capacidad de lectura consumida por las consultas al índice de pendientes
+        self.read_stats = {'queries': 0, 'items': 0, 'consumed_rcu': 0.0}
+        # Write sharding del índice de pendientes: número de particiones (K) por salón.
+        # Con SUBSCRIBER_WRITE_SHARDS_PER_SALON, K se guarda por salón en un item de
+        # configuración de la tabla para que todos los procesos usen el mismo; cada proceso
+        # lo cachea durante unos segundos. Sin él no se lee ninguna configuración
+        self.default_write_shards = int(os.getenv('SUBSCRIBER_WRITE_SHARDS', '1'))
+        self.per_salon_write_shards = os.getenv('SUBSCRIBER_WRITE_SHARDS_PER_SALON', 'false').lower() in ('1', 'true', 'yes')
+        self.write_shards_ttl = int(os.getenv('WRITE_SHARDS_CACHE_SECONDS', '60'))
+        self.write_shards_cache_size = int(os.getenv('WRITE_SHARDS_CACHE_MAX_SALONS', '10000'))
+        # salón -> (expira, K, K anterior durante un reshard, inicio del reshard), en orden LRU
+        self._write_shards_cache = OrderedDict()
+        self._write_shards_lock = threading.Lock()
+        self._read_stats_lock = threading.Lock()
+        # Seguidores por salón en caché, actualizados con cada (des)suscripción
+        self.follower_cache = FollowerSetCache(
+            max_followers=int(os.getenv('FOLLOWER_CACHE_MAX_FOLLOWERS', '100000')),
+            ttl=int(os.getenv('FOLLOWER_CACHE_TTL_SECONDS', '300'))
+        )
+        # Spans por mensaje exportables en formato Chrome Trace (desactivado sin ruta)
+        self.tracer = MessageTracer(
+            os.getenv('TRACE_EXPORT_PATH'),
+            max_events=int(os.getenv('TRACE_MAX_EVENTS', '100000'))
+        )
+        # Plantillas de asunto y cuerpo por tipo, salón y locale (compiladas y en caché)
+        self.templates = MessageTemplateRegistry()
         
     def validate_input(self, user_id, email, type_to_behavior):
         if not user_id or not isinstance(user_id, str):
@@ -60,35 +96,12 @@ class NotificationManager:
                         'AttributeType': 'S'  # Tipo de atributo: String
                     },
                     {
-                        'AttributeName': 'TypeBehavior',
-                        'AttributeType': 'S'  # Tipo de atributo: String
-                    },
-                    {
-                        'AttributeName': 'BeautySalonID',
+                        'AttributeName': 'PendingTypeSalon',
                         'AttributeType': 'S'  # Tipo de atributo: String
                     }
                 ],
                 GlobalSecondaryIndexes=[
-                    {
-                        'IndexName': 'TypeBehavior-BeautySalonID-index',
-                        'KeySchema': [
-                            {
-                                'AttributeName': 'TypeBehavior',
-                                'KeyType': 'HASH'  # Clave de partición
-                            },
-                            {
-                                'AttributeName': 'BeautySalonID',
-                                'KeyType': 'RANGE'  # Clave de ordenación
-                            }
-                        ],
-                        'Projection': {
-                            'ProjectionType': 'ALL'
-                        },
-                        'ProvisionedThroughput': {
-                            'ReadCapacityUnits': 5,
-                            'WriteCapacityUnits': 5
-                        }
-                    }
+                    self._pending_index_definition()
                 ],
                 ProvisionedThroughput={
                     'ReadCapacityUnits': 5,
@@ -110,6 +123,253 @@ class NotificationManager:
         except Exception as e:
             print(f"Error creating table: {e}")
 
+    def _pending_index_definition(self):
+        # Solo los items con el atributo PendingTypeSalon aparecen en el índice
+        return {
+            'IndexName': self.pending_index_name,
+            'KeySchema': [
+                {
+                    'AttributeName': 'PendingTypeSalon',
+                    'KeyType': 'HASH'  # Clave de partición: TypeBehavior#BeautySalonID
+                },
+                {
+                    'AttributeName': 'Timestamp',
+                    'KeyType': 'RANGE'  # Clave de ordenación
+                }
+            ],
+            'Projection': {
+                'ProjectionType': 'ALL'
+            },
+            'ProvisionedThroughput': {
+                'ReadCapacityUnits': 5,
+                'WriteCapacityUnits': 5
+            }
+        }
+
+    def create_pending_index(self, backfill=True):
+        # Añade el índice disperso a una tabla creada antes de que existiera
+        try:
+            response = self.dynamodb.update_table(
+                TableName=self.table_name,
+                AttributeDefinitions=[
+                    {'AttributeName': 'PendingTypeSalon', 'AttributeType': 'S'},
+                    {'AttributeName': 'Timestamp', 'AttributeType': 'S'}
+                ],
+                GlobalSecondaryIndexUpdates=[
+                    {'Create': self._pending_index_definition()}
+                ]
+            )
+            print("Pending index creation started!")
+        except ClientError as e:
+            print(f"Client error while creating pending index: {e}")
+            return None
+        if backfill:
+            # DynamoDB incorpora al índice en construcción los atributos escritos mientras tanto
+            self.backfill_pending_index()
+        return response
+
+    def backfill_pending_index(self, page_size=100):
+        # Los items escritos antes del índice disperso no tienen PendingTypeSalon: sin él
+        # los suscriptores existentes dejarían de aparecer en las lecturas del índice
+        scan_args = {
+            'TableName': self.table_name,
+            'FilterExpression': '#s = :pending AND Active = :active AND attribute_exists(BeautySalonID) '
+                                'AND attribute_not_exists(PendingTypeSalon)',
+            'ExpressionAttributeNames': {'#s': 'Status', '#ts': 'Timestamp'},
+            'ExpressionAttributeValues': {':pending': {'S': 'Pendiente'}, ':active': {'BOOL': True}},
+            'ProjectionExpression': 'UserID_TypeBehavior_BeautySalonID, #ts, BeautySalonID',
+            'Limit': page_size
+        }
+        updated = 0
+        while True:
+            response = self.dynamodb.scan(**scan_args)
+            for item in response.get('Items', []):
+                user_id, type_to_behavior, _ = item['UserID_TypeBehavior_BeautySalonID']['S'].split('#', 2)
+                beauty_salon_id = item['BeautySalonID']['S']
+                try:
+                    self.dynamodb.update_item(
+                        TableName=self.table_name,
+                        Key={
+                            'UserID_TypeBehavior_BeautySalonID': item['UserID_TypeBehavior_BeautySalonID'],
+                            'Timestamp': item['Timestamp']
+                        },
+                        UpdateExpression='SET PendingTypeSalon = :key',
+                        # Si el estado cambió desde el scan, el item ya no debe entrar al índice
+                        ConditionExpression='#s = :pending AND attribute_not_exists(PendingTypeSalon)',
+                        ExpressionAttributeNames={'#s': 'Status'},
+                        ExpressionAttributeValues={
+                            ':key': {'S': self.pending_index_key(type_to_behavior, beauty_salon_id, user_id)},
+                            ':pending': {'S': 'Pendiente'}
+                        }
+                    )
+                    updated += 1
+                except ClientError as e:
+                    if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                        raise
+            last_key = response.get('LastEvaluatedKey')
+            if not last_key:
+                break
+            scan_args['ExclusiveStartKey'] = last_key
+        print(f"✅ Índice de pendientes completado: {updated} items actualizados")
+        return updated
+
+    def drop_legacy_type_index(self):
+        # El índice TypeBehavior-BeautySalonID-index (partición solo por tipo) recibía
+        # todas las escrituras de la tabla; las lecturas usan el índice de pendientes
+        try:
+            self.dynamodb.update_table(
+                TableName=self.table_name,
+                GlobalSecondaryIndexUpdates=[{'Delete': {'IndexName': 'TypeBehavior-BeautySalonID-index'}}]
+            )
+            print("🧹 Índice TypeBehavior-BeautySalonID-index eliminado")
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('ResourceNotFoundException', 'ValidationException'):
+                print("Legacy index does not exist.")
+                return False
+            raise
+
+    def _write_shards_key(self, beauty_salon_id):
+        return {
+            'UserID_TypeBehavior_BeautySalonID': {'S': f"config#WriteShards#{beauty_salon_id}"},
+            'Timestamp': {'S': '0'}
+        }
+
+    def _load_write_shards(self, beauty_salon_id, fresh=False):
+        # Devuelve (K, K anterior o None, inicio del reshard o None)
+        if not self.per_salon_write_shards and not fresh:
+            return self.default_write_shards, None, None
+        now = time.time()
+        with self._write_shards_lock:
+            cached = self._write_shards_cache.get(beauty_salon_id)
+            if cached is not None and not fresh:
+                self._write_shards_cache.move_to_end(beauty_salon_id)
+                if cached[0] > now:
+                    return cached[1:]
+        try:
+            response = self.dynamodb.get_item(
+                TableName=self.table_name,
+                Key=self._write_shards_key(beauty_salon_id),
+                ConsistentRead=True
+            )
+        except ClientError as e:
+            if fresh:
+                raise
+            # Una lectura fallida no debe impedir la escritura: se usa el último K conocido
+            # (o el de por defecto) y se vuelve a intentar en unos segundos
+            print(f"⚠️ No se pudo leer el K del salón {beauty_salon_id}, se usa el último conocido: {e}")
+            config = cached[1:] if cached is not None else (self.default_write_shards, None, None)
+            self._cache_write_shards(beauty_salon_id, now + min(self.write_shards_ttl, 5), config)
+            return config
+        item = response.get('Item') or {}
+        config = (
+            int(item['Shards']['N']) if 'Shards' in item else self.default_write_shards,
+            int(item['PreviousShards']['N']) if 'PreviousShards' in item else None,
+            float(item['ReshardStartedAt']['N']) if 'ReshardStartedAt' in item else None
+        )
+        self._cache_write_shards(beauty_salon_id, now + self.write_shards_ttl, config)
+        return config
+
+    def _cache_write_shards(self, beauty_salon_id, expires_at, config):
+        with self._write_shards_lock:
+            self._write_shards_cache[beauty_salon_id] = (expires_at,) + tuple(config)
+            self._write_shards_cache.move_to_end(beauty_salon_id)
+            while len(self._write_shards_cache) > self.write_shards_cache_size:
+                self._write_shards_cache.popitem(last=False)
+
+    def _save_write_shards(self, beauty_salon_id, shards, previous=None):
+        item = dict(self._write_shards_key(beauty_salon_id), Shards={'N': str(shards)})
+        if previous is not None:
+            item['PreviousShards'] = {'N': str(previous)}
+            item['ReshardStartedAt'] = {'N': str(time.time())}
+        self.dynamodb.put_item(TableName=self.table_name, Item=item)
+        with self._write_shards_lock:
+            self._write_shards_cache.pop(beauty_salon_id, None)
+
+    def set_salon_write_shards(self, beauty_salon_id, shards):
+        # Inicia el reshard del salón: se escribe con el nuevo K y se leen los sufijos de
+        # ambos hasta que finish_salon_reshard() mueva los items escritos con el anterior
+        if shards < 1:
+            raise ValueError("Invalid number of write shards")
+        self.per_salon_write_shards = True
+        current, previous, _ = self._load_write_shards(beauty_salon_id, fresh=True)
+        if previous is not None:
+            raise ValueError(f"Reshard of salon {beauty_salon_id} already in progress; call finish_salon_reshard() first")
+        if current == shards:
+            return False
+        self._save_write_shards(beauty_salon_id, shards, current)
+        print(f"🔀 Salón {beauty_salon_id}: reshard de K {current} a {shards} iniciado")
+        return True
+
+    def finish_salon_reshard(self, beauty_salon_id, wait=False):
+        # Mueve los items escritos con el K anterior. Antes deben pasar WRITE_SHARDS_CACHE_SECONDS
+        # desde el inicio para que todos los procesos escriban ya con el nuevo K
+        shards, previous, started_at = self._load_write_shards(beauty_salon_id, fresh=True)
+        if previous is None:
+            return 0
+        remaining = (started_at or 0) + self.write_shards_ttl - time.time()
+        if remaining > 0:
+            if not wait:
+                raise ValueError(f"Reshard of salon {beauty_salon_id} can finish in {remaining:.0f} seconds")
+            time.sleep(remaining)
+
+        moved = 0
+        for type_to_behavior in ('Subscription', 'Offer', 'Reminder'):
+            for shard in range(previous):
+                old_key = self.pending_index_key(type_to_behavior, beauty_salon_id, shard=shard, shards=previous)
+                for item in self._iter_pending_partition(old_key, 100):
+                    user_id = item['UserID_TypeBehavior_BeautySalonID']['S'].split('#')[0]
+                    new_key = self.pending_index_key(type_to_behavior, beauty_salon_id, user_id, shards=shards)
+                    if new_key == old_key:
+                        continue
+                    try:
+                        self.dynamodb.update_item(
+                            TableName=self.table_name,
+                            Key={
+                                'UserID_TypeBehavior_BeautySalonID': item['UserID_TypeBehavior_BeautySalonID'],
+                                'Timestamp': item['Timestamp']
+                            },
+                            UpdateExpression='SET PendingTypeSalon = :new',
+                            # Si ya se envió (el atributo se quitó) no se vuelve a agregar al índice
+                            ConditionExpression='PendingTypeSalon = :old',
+                            ExpressionAttributeValues={':new': {'S': new_key}, ':old': {'S': old_key}}
+                        )
+                        moved += 1
+                    except ClientError as e:
+                        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                            raise
+
+        self._save_write_shards(beauty_salon_id, shards)
+        print(f"🔀 Salón {beauty_salon_id}: K {previous} -> {shards}, {moved} items movidos")
+        return moved
+
+    def get_salon_write_shards(self, beauty_salon_id):
+        return self._load_write_shards(beauty_salon_id)[0]
+
+    def pending_partition_keys(self, type_to_behavior, beauty_salon_id):
+        # Sufijos a leer: los del K actual y, si hay un reshard en curso, los del anterior
+        shards, previous, _ = self._load_write_shards(beauty_salon_id)
+        partition_keys = [
+            self.pending_index_key(type_to_behavior, beauty_salon_id, shard=shard, shards=shards)
+            for shard in range(shards)
+        ]
+        for shard in range(previous or 0):
+            partition_key = self.pending_index_key(type_to_behavior, beauty_salon_id, shard=shard, shards=previous)
+            if partition_key not in partition_keys:
+                partition_keys.append(partition_key)
+        return partition_keys
+
+    def pending_index_key(self, type_to_behavior, beauty_salon_id, user_id=None, shard=None, shards=None):
+        key = f"{type_to_behavior}#{beauty_salon_id}"
+        if shards is None:
+            shards = self.get_salon_write_shards(beauty_salon_id)
+        if shards == 1:
+            return key
+        if shard is None:
+            # Hash estable del usuario: sus notificaciones siempre caen en el mismo sufijo
+            shard = zlib.crc32(str(user_id).encode('utf-8')) % shards
+        return f"{key}#{shard}"
+
     def update_notifications(self, user_id, email, type_to_behavior, beauty_salon_id=None, date=None, time=None, service=None, offer_id=None, description=None, reminder_id=None):
         try:
             # Validar entradas
@@ -129,6 +389,8 @@ class NotificationManager:
 
             if beauty_salon_id is not None:
                 item['BeautySalonID'] = {'S': beauty_salon_id}  
+                # Las notificaciones nuevas están pendientes y activas: entran al índice disperso
+                item['PendingTypeSalon'] = {'S': self.pending_index_key(type_to_behavior, beauty_salon_id, user_id)}
 
             if type_to_behavior == 'Reminder':
                 if date is not None:
@@ -149,6 +411,8 @@ class NotificationManager:
                 TableName=self.table_name,
                 Item=item
             )
+            if type_to_behavior == 'Subscription' and beauty_salon_id is not None:
+                self.follower_cache.add(beauty_salon_id, user_id, email)
             print("Notification updated successfully.")
         except ClientError as e:
             print(f"Client error while updating notification: {e}")
@@ -167,14 +431,16 @@ class NotificationManager:
         except ClientError as e:
             return {"status": "error", "message": str(e)}
 
-    def send_offer_notification(self, user_id, email, beauty_salon_id, offer_id, description):
+    def send_offer_notification(self, user_id, email, beauty_salon_id, offer_id, description, locale=None):
         max_retries = 3
         retry_delay = 2  # segundos
         attempt = 0
         while attempt < max_retries:
             try:
-                subject = "New Offer Available"
-                body = f"Hello {user_id},\n\nBeauty salon {beauty_salon_id} has a new offer: {description}."
+                subject, body = self.templates.render(
+                    'Offer', beauty_salon_id, locale,
+                    user_id=user_id, offer_id=offer_id, description=description
+                )
                 response = self.sns_client.publish(
                     TopicArn=os.getenv('ARN'),
                     Message=body,
@@ -201,7 +467,46 @@ class NotificationManager:
                     self.update_notification_status(user_id, 'Offer', beauty_salon_id, 'Error')
                     return {"status": "error", "message": str(e)}
 
-    def send_reminder_notification(self, email, user_id, beauty_salon_id, date, time_str, service):
+    def send_offer_digest_notification(self, user_id, email, beauty_salon_id, offers, locale=None):
+        # Una sola publicación para varias ofertas del mismo salón
+        max_retries = 3
+        retry_delay = 2  # segundos
+        attempt = 0
+        offer_ids = [offer['offer_id'] for offer in offers]
+        while attempt < max_retries:
+            try:
+                subject, body = self.templates.render(
+                    'OfferDigest', beauty_salon_id, locale,
+                    user_id=user_id,
+                    offer_count=len(offers),
+                    offers="\n".join(f"- {offer['description']}" for offer in offers)
+                )
+                response = self.sns_client.publish(
+                    TopicArn=os.getenv('ARN'),
+                    Message=body,
+                    Subject=subject,
+                    MessageAttributes={
+                        'email': {
+                            'DataType': 'String',
+                            'StringValue': email
+                        }
+                    }
+                )
+                # Actualizar las ofertas del digest en una sola escritura
+                self.update_notification_status_batch(user_id, 'Offer', beauty_salon_id, 'Enviado', offer_ids)
+                print(f"Offer digest with {len(offers)} offers sent to {user_id} and statuses updated.")
+                return response
+            except ClientError as e:
+                attempt += 1
+                print(f"❌ Error enviando digest de ofertas (Intento {attempt}/{max_retries}): {e}")
+                if attempt < max_retries:
+                    print(f"🔄 Volviendo a intentar en {retry_delay} segundos...")
+                    time.sleep(retry_delay)
+                else:
+                    self.update_notification_status_batch(user_id, 'Offer', beauty_salon_id, 'Error', offer_ids)
+                    return {"status": "error", "message": str(e)}
+
+    def send_reminder_notification(self, email, user_id, beauty_salon_id, date, time_str, service, locale=None):
         max_retries = 3
         retry_delay = 2  # segundos
         attempt = 0
@@ -212,8 +517,10 @@ class NotificationManager:
                 print(f"- Fecha: {date}")
                 print(f"- Hora: {time_str}")
                 
-                subject = "Appointment Reminder"
-                body = f"Hello {user_id},\n\nThis is a reminder for your appointment at beauty salon {beauty_salon_id} on {date} at {time_str} for {service}."
+                subject, body = self.templates.render(
+                    'Reminder', beauty_salon_id, locale,
+                    user_id=user_id, date=date, time=time_str, service=service
+                )
                 
                 response = self.sns_client.publish(
                     TopicArn=os.getenv('ARN'),
@@ -245,6 +552,10 @@ class NotificationManager:
                     return {"status": "error", "message": str(e)}
 
     def update_notification_status(self, user_id, type_to_behavior, beauty_salon_id, status):
+        with self.tracer.span('status_update', status=status):
+            return self._update_notification_status(user_id, type_to_behavior, beauty_salon_id, status)
+
+    def _update_notification_status(self, user_id, type_to_behavior, beauty_salon_id, status):
         try:
             # La clave compuesta debe usar user_id, no email
             user_key = f"{user_id}#{type_to_behavior}#{beauty_salon_id}"
@@ -270,15 +581,25 @@ class NotificationManager:
                 timestamp = response['Items'][0]['Timestamp']['S']
                 print(f"- Encontrada notificación con timestamp: {timestamp}")
                 
+                # Mantener el índice disperso: solo las pendientes conservan PendingTypeSalon
+                if status == 'Pendiente' and beauty_salon_id is not None:
+                    update_expression = 'SET #s = :status, PendingTypeSalon = :pending'
+                    expression_values = {
+                        ':status': {'S': status},
+                        ':pending': {'S': self.pending_index_key(type_to_behavior, beauty_salon_id, user_id)}
+                    }
+                else:
+                    update_expression = 'SET #s = :status REMOVE PendingTypeSalon'
+                    expression_values = {':status': {'S': status}}
                 update_response = self.dynamodb.update_item(
                     TableName=self.table_name,
                     Key={
                         'UserID_TypeBehavior_BeautySalonID': {'S': user_key},
                         'Timestamp': {'S': timestamp}
                     },
-                    UpdateExpression='SET #s = :status',
+                    UpdateExpression=update_expression,
                     ExpressionAttributeNames={'#s': 'Status'},
-                    ExpressionAttributeValues={':status': {'S': status}},
+                    ExpressionAttributeValues=expression_values,
                     ReturnValues='ALL_NEW'  # Retorna el item actualizado
                 )
                 print(f"✅ Estado actualizado exitosamente a '{status}'")
@@ -290,10 +611,99 @@ class NotificationManager:
             print(f"❌ Error actualizando estado: {str(e)}")
             raise
 
-    def send_unsubscription_notification(self, email, user_id, beauty_salon_id):
+    def update_notification_status_batch(self, user_id, type_to_behavior, beauty_salon_id, status, offer_ids=None):
+        with self.tracer.span('status_update', status=status, batch=True):
+            return self._update_notification_status_batch(user_id, type_to_behavior, beauty_salon_id, status, offer_ids)
+
+    def _update_notification_status_batch(self, user_id, type_to_behavior, beauty_salon_id, status, offer_ids=None):
+        # Actualiza las notificaciones pendientes de la clave con una lectura y escrituras
+        # transaccionales de hasta 100 items; con offer_ids solo las de esas ofertas
+        user_key = f"{user_id}#{type_to_behavior}#{beauty_salon_id}"
+        if offer_ids is not None:
+            offer_ids = set(offer_ids)
+        query_args = {
+            'TableName': self.table_name,
+            'KeyConditionExpression': 'UserID_TypeBehavior_BeautySalonID = :key',
+            'FilterExpression': '#s = :pending',
+            'ExpressionAttributeNames': {'#s': 'Status', '#ts': 'Timestamp'},
+            'ExpressionAttributeValues': {
+                ':key': {'S': user_key},
+                ':pending': {'S': 'Pendiente'}
+            },
+            'ProjectionExpression': '#ts, OfferID'
+        }
+        timestamps = []
+        while True:
+            response = self.dynamodb.query(**query_args)
+            timestamps.extend(
+                item['Timestamp']['S'] for item in response.get('Items', [])
+                # Las ofertas escritas después de armar el digest siguen pendientes
+                if offer_ids is None or item.get('OfferID', {}).get('S') in offer_ids
+            )
+            if not response.get('LastEvaluatedKey'):
+                break
+            query_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+        for start in range(0, len(timestamps), 100):
+            self.dynamodb.transact_write_items(
+                TransactItems=[
+                    {
+                        'Update': {
+                            'TableName': self.table_name,
+                            'Key': {
+                                'UserID_TypeBehavior_BeautySalonID': {'S': user_key},
+                                'Timestamp': {'S': timestamp}
+                            },
+                            'UpdateExpression': 'SET #s = :status REMOVE PendingTypeSalon',
+                            'ExpressionAttributeNames': {'#s': 'Status'},
+                            'ExpressionAttributeValues': {':status': {'S': status}}
+                        }
+                    }
+                    for timestamp in timestamps[start:start + 100]
+                ]
+            )
+        print(f"✅ {len(timestamps)} notificaciones actualizadas a '{status}'")
+        return len(timestamps)
+
+    def deactivate_subscription(self, user_id, beauty_salon_id):
+        # Baja en la fuente de verdad: la suscripción deja de estar activa y sale del
+        # índice de pendientes, del que se leen los seguidores en los demás procesos
+        user_key = f"{user_id}#Subscription#{beauty_salon_id}"
+        query_args = {
+            'TableName': self.table_name,
+            'KeyConditionExpression': 'UserID_TypeBehavior_BeautySalonID = :key',
+            'FilterExpression': 'Active = :active',
+            'ExpressionAttributeNames': {'#ts': 'Timestamp'},
+            'ExpressionAttributeValues': {
+                ':key': {'S': user_key},
+                ':active': {'BOOL': True}
+            },
+            'ProjectionExpression': '#ts'
+        }
+        deactivated = 0
+        while True:
+            response = self.dynamodb.query(**query_args)
+            for item in response.get('Items', []):
+                self.dynamodb.update_item(
+                    TableName=self.table_name,
+                    Key={
+                        'UserID_TypeBehavior_BeautySalonID': {'S': user_key},
+                        'Timestamp': item['Timestamp']
+                    },
+                    UpdateExpression='SET Active = :inactive REMOVE PendingTypeSalon',
+                    ExpressionAttributeValues={':inactive': {'BOOL': False}}
+                )
+                deactivated += 1
+            if not response.get('LastEvaluatedKey'):
+                break
+            query_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        return deactivated
+
+    def send_unsubscription_notification(self, email, user_id, beauty_salon_id, locale=None):
         try:
-            subject = "Unsubscription Confirmation"
-            body = f"Hello {user_id},\n\nYou have successfully unsubscribed from beauty salon {beauty_salon_id}."
+            self.deactivate_subscription(user_id, beauty_salon_id)
+            self.follower_cache.remove(beauty_salon_id, user_id)
+            subject, body = self.templates.render('Unsubscription', beauty_salon_id, locale, user_id=user_id)
             response = self.sns_client.publish(
                 TopicArn=os.getenv('ARN'),
                 Message=body,
@@ -309,52 +719,91 @@ class NotificationManager:
         except ClientError as e:
             return {"status": "error", "message": str(e)}
 
+    def get_salon_followers(self, beauty_salon_id):
+        # Lista de (user_id, email); solo se lee DynamoDB si el salón no está en caché
+        followers = self.follower_cache.get(beauty_salon_id)
+        if followers is not None:
+            return followers
+
+        followers = []
+        for item in self.iter_pending_notifications('Subscription', beauty_salon_id):
+            # Extraer el user_id directamente de la clave compuesta
+            user_id = item['UserID_TypeBehavior_BeautySalonID']['S'].split('#')[0]
+            followers.append((user_id, item['Email']['S']))
+        self.follower_cache.put(beauty_salon_id, followers)
+        return followers
+
     def send_offer_notification_to_all_followers(self, beauty_salon_id, offer_id, description):
         try:
-            response = self.dynamodb.query(
-                TableName=self.table_name,
-                IndexName='TypeBehavior-BeautySalonID-index',
-                KeyConditionExpression='TypeBehavior = :type_behavior AND BeautySalonID = :beauty_salon_id',
-                ExpressionAttributeValues={
-                    ':type_behavior': {'S': 'Subscription'},
-                    ':beauty_salon_id': {'S': beauty_salon_id},
-                    ':status': {'S': 'Pendiente'}
-                },
-                FilterExpression='Status = :status'
-            )
-            
-            for item in response.get('Items', []):
-                if item.get('Active', {}).get('BOOL', False):
-                    email = item['Email']['S']
-                    # Extraer el user_id directamente de la clave compuesta
-                    user_id = item['UserID_TypeBehavior_BeautySalonID']['S'].split('#')[0]
-                    self.send_offer_notification(user_id, email, beauty_salon_id, offer_id, description)
+            for user_id, email in self.get_salon_followers(beauty_salon_id):
+                self.send_offer_notification(user_id, email, beauty_salon_id, offer_id, description)
             
             return {"status": "success", "message": "Notifications sent to all active followers"}
         except ClientError as e:
             return {"status": "error", "message": str(e)}
 
+    def iter_pending_notifications(self, type_behavior, beauty_salon_id, page_size=100):
+        partition_keys = self.pending_partition_keys(type_behavior, beauty_salon_id)
+        if len(partition_keys) == 1:
+            yield from self._iter_pending_partition(partition_keys[0], page_size)
+            return
+
+        # Scatter-gather: la primera página de cada sufijo se consulta en paralelo y las
+        # siguientes a medida que el merge las consume; en memoria hay una página por sufijo
+        query_args = [self._pending_query_args(partition_key, page_size) for partition_key in partition_keys]
+        with ThreadPoolExecutor(max_workers=len(query_args)) as executor:
+            first_pages = list(executor.map(self._query_pending_page, query_args))
+        partitions = [
+            self._iter_pending_pages(args, response)
+            for args, response in zip(query_args, first_pages)
+        ]
+        yield from heapq.merge(*partitions, key=lambda item: item['Timestamp']['S'])
+
+    def _iter_pending_partition(self, partition_key, page_size):
+        query_args = self._pending_query_args(partition_key, page_size)
+        yield from self._iter_pending_pages(query_args, self._query_pending_page(query_args))
+
+    def _iter_pending_pages(self, query_args, response):
+        while True:
+            yield from response.get('Items', [])
+            last_key = response.get('LastEvaluatedKey')
+            if not last_key:
+                return
+            query_args['ExclusiveStartKey'] = last_key
+            response = self._query_pending_page(query_args)
+
+    def _query_pending_page(self, query_args):
+        response = self.dynamodb.query(**query_args)
+        with self._read_stats_lock:
+            self.read_stats['queries'] += 1
+            self.read_stats['items'] += len(response.get('Items', []))
+            self.read_stats['consumed_rcu'] += response.get('ConsumedCapacity', {}).get('CapacityUnits', 0.0)
+        return response
+
+    def _pending_query_args(self, partition_key, page_size):
+        # Consulta paginada del índice disperso: no se leen items enviados ni inactivos
+        return {
+            'TableName': self.table_name,
+            'IndexName': self.pending_index_name,
+            'KeyConditionExpression': 'PendingTypeSalon = :pending',
+            'ExpressionAttributeValues': {
+                ':pending': {'S': partition_key}
+            },
+            'Limit': page_size,
+            'ReturnConsumedCapacity': 'TOTAL'
+        }
+
+    def get_read_capacity_per_item(self):
+        if not self.read_stats['items']:
+            return 0.0
+        return self.read_stats['consumed_rcu'] / self.read_stats['items']
+
     def get_recent_notifications_by_type_and_salon(self, type_behavior, beauty_salon_id):
         try:
-            # Consultar solo las notificaciones pendientes
-            response = self.dynamodb.query(
-                TableName=self.table_name,
-                IndexName='TypeBehavior-BeautySalonID-index',
-                KeyConditionExpression='TypeBehavior = :type_behavior AND BeautySalonID = :beauty_salon_id',
-                ExpressionAttributeValues={
-                    ':type_behavior': {'S': type_behavior},
-                    ':beauty_salon_id': {'S': beauty_salon_id},
-                    ':status': {'S': 'Pendiente'},  # Solo notificaciones pendientes
-                    ':active': {'BOOL': True}  # Solo notificaciones activas
-                },
-                FilterExpression='#s = :status AND Active = :active',
-                ExpressionAttributeNames={
-                    '#s': 'Status'
-                }
-            )
-            
-            items = response.get('Items', [])
+            # Consultar solo las notificaciones pendientes (todas las páginas)
+            items = list(self.iter_pending_notifications(type_behavior, beauty_salon_id))
             print(f"Encontradas {len(items)} notificaciones pendientes de tipo {type_behavior}")
+            print(f"- RCU por item: {self.get_read_capacity_per_item():.3f}")
             return items
             
         except ClientError as e:
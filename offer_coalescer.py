@@ -0,0 +1,54 @@
+import threading
+import time
+
+class OfferCoalescer:
+    def __init__(self, window_seconds=60, max_offers=20):
+        self.window_seconds = window_seconds
+        self.max_offers = max_offers  # Un digest se envía antes si acumula tantas ofertas
+        # (user_id, salón) -> {'email', 'locale', 'first_seen', 'offers': [...], 'receipts': [...]}
+        self._groups = {}
+        self._lock = threading.Lock()
+        self.stats = {'offers': 0, 'digests': 0}
+
+    def add(self, user_id, email, beauty_salon_id, offer_id, description, receipt_handle=None, locale=None):
+        key = (user_id, beauty_salon_id)
+        with self._lock:
+            group = self._groups.get(key)
+            if group is None:
+                group = {
+                    'email': email,
+                    'locale': locale,
+                    'first_seen': time.time(),
+                    'offers': [],
+                    'receipts': []
+                }
+                self._groups[key] = group
+            # La misma oferta repetida dentro de la ventana se fusiona
+            if all(offer['offer_id'] != offer_id for offer in group['offers']):
+                group['offers'].append({'offer_id': offer_id, 'description': description})
+            group['receipts'].append(receipt_handle)
+            self.stats['offers'] += 1
+
+    def pop_due(self, force=False):
+        # Devuelve los grupos cuya ventana terminó (o todos si force) como
+        # [(user_id, salón, grupo)] y los retira del coalescedor
+        now = time.time()
+        due = []
+        with self._lock:
+            for key, group in list(self._groups.items()):
+                expired = now - group['first_seen'] >= self.window_seconds
+                if force or expired or len(group['offers']) >= self.max_offers:
+                    due.append((key[0], key[1], self._groups.pop(key)))
+            self.stats['digests'] += len(due)
+        return due
+
+    def pending_count(self):
+        with self._lock:
+            return sum(len(group['receipts']) for group in self._groups.values())
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        # Ofertas fusionadas por cada publicación enviada
+        stats['merge_ratio'] = stats['offers'] / stats['digests'] if stats['digests'] else 0.0
+        return stats
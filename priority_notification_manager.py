@@ -1,11 +1,56 @@
 from notification_manager import NotificationManager
 from distributed_priority_queue import DistributedPriorityQueue  # Importar la cola de prioridad distribuida
+from offer_coalescer import OfferCoalescer
+from sampling_profiler import SamplingProfiler
 import time  # Importar time para delays en reintentos
+import datetime
+from zoneinfo import ZoneInfo
+import os
 
 class PriorityNotificationManager(NotificationManager):
-    def __init__(self):
+    def __init__(self, deadline_aware=None, track_in_flight=None):
         super().__init__()
-        self.priority_queue = DistributedPriorityQueue()  # Usar la cola de prioridad distribuida
+        # Modo de prioridad dinámica: los recordatorios se enrutan y ordenan por su deadline
+        if deadline_aware is None:
+            deadline_aware = os.getenv('DEADLINE_AWARE_PRIORITY', 'false').lower() in ('1', 'true', 'yes')
+        self.deadline_aware = deadline_aware
+        # Recordatorios con menos holgura que esta ventana van a la cola 'high'
+        self.deadline_urgent_window = int(os.getenv('DEADLINE_URGENT_WINDOW_SECONDS', '21600'))
+        self.deadline_stats = {'on_time': 0, 'late': 0}
+        # Zona horaria en la que se expresan la fecha y hora de las citas (nombre IANA);
+        # un recordatorio puede traer su propia 'timezone' (la del salón)
+        self.appointment_timezone = os.getenv('APPOINTMENT_TIMEZONE', 'UTC')
+        # Seguimiento de mensajes en vuelo con heartbeats de visibilidad (entrega al-menos-una-vez)
+        if track_in_flight is None:
+            track_in_flight = os.getenv('SQS_TRACK_IN_FLIGHT', 'false').lower() in ('1', 'true', 'yes')
+        self.priority_queue = DistributedPriorityQueue(  # Usar la cola de prioridad distribuida
+            deadline_ordering=deadline_aware,
+            track_in_flight=track_in_flight,
+            payload_validator=self.validate_queue_payload,
+            depth_refresh_interval=int(os.getenv('SQS_DEPTH_REFRESH_SECONDS', '0'))
+        )
+        # Los spans de dequeue y decode se registran en la cola con el mismo trazador
+        self.priority_queue.tracer = self.tracer
+        # Profiler por muestreo del consumidor; se activa/desactiva en caliente con SIGUSR2
+        self.profiler = SamplingProfiler(
+            interval=int(os.getenv('PROFILER_INTERVAL_MS', '10')) / 1000,
+            dump_interval=int(os.getenv('PROFILER_DUMP_SECONDS', '60')),
+            output_path=os.getenv('PROFILER_OUTPUT_PATH', 'consumer_profile.folded')
+        )
+        if os.getenv('PROFILER_SIGNAL_TOGGLE', 'false').lower() in ('1', 'true', 'yes'):
+            self.profiler.install_signal_toggle()
+        if os.getenv('PROFILER_ENABLED', 'false').lower() in ('1', 'true', 'yes'):
+            self.profiler.start()
+        # En modo FIFO los mensajes se agrupan por usuario ('user') o por salón ('salon')
+        self.fifo_group_by = os.getenv('SQS_FIFO_GROUP_BY', 'user')
+        # Agrupar ráfagas de ofertas del mismo salón en un digest por destinatario (0 = desactivado)
+        digest_window = int(os.getenv('OFFER_DIGEST_WINDOW_SECONDS', '0'))
+        self.offer_coalescer = None
+        if digest_window > 0:
+            self.offer_coalescer = OfferCoalescer(
+                window_seconds=digest_window,
+                max_offers=int(os.getenv('OFFER_DIGEST_MAX_OFFERS', '20'))
+            )
 
     def get_priority_for_type(self, notification_type):
         # Definir las prioridades según el tipo de notificación
@@ -18,23 +63,87 @@ class PriorityNotificationManager(NotificationManager):
         return priority_map.get(notification_type, 10)  # Por defecto, prioridad baja si no se encuentra el tipo
 
     def add_notification_to_queue(self, notification_type, user_id, email, **kwargs):
-        # Verificar si la notificación ya está en la cola para evitar duplicados
-        existing = self.check_existing_notification(notification_type, user_id, **kwargs)
-        if existing:
-            print(f"⚠️ Notificación {notification_type} para {user_id} ya está en la cola.")
-            return
-        priority_level = self.get_priority_level(notification_type)
-        self.priority_queue.put(priority_level, (notification_type, user_id, email, kwargs))
+        # Verificar si la notificación ya está en la cola para evitar duplicados.
+        # En modo FIFO la deduplicación la hace SQS y se evita la consulta a DynamoDB.
+        # Con el spool local tampoco se consulta: el consumidor verifica antes de enviar
+        if not self.priority_queue.fifo and not self.priority_queue.spool_path:
+            existing = self.check_existing_notification(notification_type, user_id, **kwargs)
+            if existing:
+                print(f"⚠️ Notificación {notification_type} para {user_id} ya está en la cola.")
+                return
+        deadline = self.get_notification_deadline(notification_type, **kwargs) if self.deadline_aware else None
+        priority_level = self.get_priority_level(notification_type, deadline)
+        with self.tracer.span('enqueue', type=notification_type, priority_level=priority_level) as trace_context:
+            self.priority_queue.put(
+                priority_level,
+                (notification_type, user_id, email, kwargs),
+                deadline=deadline,
+                shard_key=user_id,  # Mismo shard para todas las notificaciones de un usuario (en FIFO, del grupo)
+                group_id=self.get_message_group_id(user_id, **kwargs),
+                message_attributes=self.tracer.inject(trace_context)  # El consumidor continúa la traza
+            )
         print(f"✅ {notification_type} añadido a la cola '{priority_level}'")
 
-    def get_priority_level(self, notification_type):
+    def get_message_group_id(self, user_id, **kwargs):
+        if self.fifo_group_by == 'salon' and kwargs.get('beauty_salon_id'):
+            return kwargs['beauty_salon_id']
+        return user_id
+
+    def validate_queue_payload(self, data):
+        # Los mensajes de la cola deben tener la forma (tipo, user_id, email, datos)
+        if not isinstance(data, (list, tuple)) or len(data) != 4:
+            raise ValueError("Invalid queue payload")
+        notification_type, user_id, email, notification_data = data
+        if not isinstance(notification_type, str) or not isinstance(user_id, str):
+            raise ValueError("Invalid queue payload")
+        if not isinstance(email, str) or not isinstance(notification_data, dict):
+            raise ValueError("Invalid queue payload")
+
+    def get_priority_level(self, notification_type, deadline=None):
         priority_map = {
             "Reminder": "high",
             "Offer": "medium",
             "Subscription": "low"
         }
+        if deadline is not None:
+            # Prioridad dinámica: solo los deadlines cercanos ocupan la cola 'high',
+            # los lejanos esperan en 'medium' sin bloquear a los urgentes
+            slack = deadline - time.time()
+            return "high" if slack <= self.deadline_urgent_window else "medium"
         return priority_map.get(notification_type, "low")
 
+    def get_notification_deadline(self, notification_type, **data):
+        # El deadline útil de un recordatorio es la hora de la cita (hora local del salón)
+        if notification_type != "Reminder" or not data.get('date'):
+            return None
+        time_str = data.get('time') or '00:00'
+        try:
+            timezone = ZoneInfo(data.get('timezone') or self.appointment_timezone)
+        except (ValueError, KeyError) as e:
+            print(f"⚠️ Zona horaria inválida para el recordatorio, se usa UTC: {e}")
+            timezone = datetime.timezone.utc
+        for time_format in ('%H:%M', '%H:%M:%S'):
+            try:
+                appointment = datetime.datetime.strptime(f"{data['date']} {time_str}", f"%Y-%m-%d {time_format}")
+                return appointment.replace(tzinfo=timezone).timestamp()
+            except ValueError:
+                continue
+        print(f"⚠️ No se pudo interpretar la fecha/hora del recordatorio: {data['date']} {time_str}")
+        return None
+
+    def record_deadline_outcome(self, notification_type, **data):
+        deadline = self.get_notification_deadline(notification_type, **data)
+        if deadline is None:
+            return
+        if time.time() > deadline:
+            self.deadline_stats['late'] += 1
+            print(f"⏰ {notification_type} enviado después de su deadline")
+        else:
+            self.deadline_stats['on_time'] += 1
+
+    def get_deadline_stats(self):
+        return dict(self.deadline_stats)
+
     def check_existing_notification(self, notification_type, user_id, **kwargs):
         try:
             beauty_salon_id = kwargs.get('beauty_salon_id')
@@ -71,46 +180,168 @@ class PriorityNotificationManager(NotificationManager):
         for priority_level in ['high', 'medium', 'low']:
             print(f"\n📥 Procesando cola '{priority_level}'...")
             while True:
-                message = self.priority_queue.get()
+                message = self.priority_queue.receive()
                 if message is None:
                     print(f"✅ Cola '{priority_level}' procesada.")
                     break
 
-                msg_priority_level, data = message
-                notification_type, user_id, email, notification_data = data
-                print(f"\n📨 Procesando mensaje:")
-                print(f"- Tipo: {notification_type}")
-                print(f"- Prioridad: {msg_priority_level}")
-                print(f"- Usuario: {user_id}")
-                print(f"- Email: {email}")
-                print(f"- Datos: {notification_data}")
-                
-                # Verificar si la notificación ya fue enviada antes de procesarla
-                if self.check_existing_notification(notification_type, user_id, **notification_data):
-                    print(f"⚠️ Notificación {notification_type} para {user_id} ya fue enviada anteriormente")
-                    continue
-                
-                processed_items.append((notification_type, msg_priority_level))
-                
-                try:
-                    # Procesar según tipo
-                    if notification_type == "Reminder":
-                        print(f"\n📅 Enviando recordatorio...")
-                        self.send_reminder_notification(user_id, email, **notification_data)
-                    elif notification_type == "Offer":
-                        print(f"\n🏷️ Enviando oferta...")
-                        self.send_offer_notification(user_id, email, **notification_data)
-                    elif notification_type == "Subscription":
-                        print(f"\n📫 Procesando suscripción...")
-                        print(f"Subscription processed for {user_id}")
-                        
-                    print(f"✅ Procesado {notification_type} con prioridad {msg_priority_level}")
-                except Exception as e:
-                    print(f"❌ Error procesando notificación: {str(e)}")
+                processed_item = self.process_message(message)
+                if processed_item:
+                    processed_items.append(processed_item)
 
+        # Enviar los digests que quedaron abiertos al vaciar las colas
+        self.flush_offer_digests(force=True)
         print(f"\n✅ Procesamiento de colas completado. Items procesados: {len(processed_items)}")
+        self.flush_diagnostics()
         return processed_items
 
+    def flush_diagnostics(self):
+        # Exporta los spans acumulados y el perfil en curso (si están activos)
+        if self.tracer.enabled:
+            self.tracer.export()
+        if self.profiler.is_running():
+            self.profiler.dump()
+
+    def consume_once(self):
+        # Un paso del bucle de los consumidores (pool y supervisor). Devuelve None si la
+        # cola estaba vacía, True si el mensaje se procesó y False si falló
+        message = self.priority_queue.receive()
+        if message is None:
+            # Aprovechar la cola vacía para enviar los digests vencidos
+            self.flush_offer_digests()
+            return None
+        try:
+            self.process_message(message)
+            return True
+        except Exception as e:
+            print(f"❌ Error procesando mensaje del consumidor: {e}")
+            # Liberarlo para que otro consumidor lo reintente (o enviarlo a cuarentena)
+            self.priority_queue.release(message[2], error=str(e))
+            return False
+
+    def process_message(self, message):
+        msg_priority_level, data, receipt_handle = message
+        trace_context = self.priority_queue.get_trace_context(receipt_handle)
+        with self.tracer.span('process_message', trace_context, type=data[0], priority_level=msg_priority_level):
+            result = self._handle_message(message)
+        # Los digests vencidos se envían tras cada mensaje, no solo cuando llega otra oferta
+        self.flush_offer_digests()
+        return result
+
+    def _handle_message(self, message):
+        msg_priority_level, data, receipt_handle = message
+        notification_type, user_id, email, notification_data = data
+        print(f"\n📨 Procesando mensaje:")
+        print(f"- Tipo: {notification_type}")
+        print(f"- Prioridad: {msg_priority_level}")
+        print(f"- Usuario: {user_id}")
+        print(f"- Email: {email}")
+        print(f"- Datos: {notification_data}")
+
+        if notification_type == "Offer" and self.offer_coalescer:
+            # El mensaje queda en vuelo hasta que se envíe su digest
+            self.offer_coalescer.add(
+                user_id,
+                email,
+                notification_data.get("beauty_salon_id"),
+                notification_data.get("offer_id"),
+                notification_data.get("description"),
+                receipt_handle=receipt_handle,
+                locale=notification_data.get("locale")
+            )
+            print(f"🧺 Oferta agrupada en el digest de {user_id}")
+            return (notification_type, msg_priority_level)
+        
+        # Verificar si la notificación ya fue enviada antes de procesarla
+        with self.tracer.span('dedup_check'):
+            existing = self.check_existing_notification(notification_type, user_id, **notification_data)
+        if existing:
+            print(f"⚠️ Notificación {notification_type} para {user_id} ya fue enviada anteriormente")
+            self.priority_queue.ack(receipt_handle)
+            return None
+        
+        try:
+            # Procesar según tipo
+            if notification_type == "Reminder":
+                print(f"\n📅 Enviando recordatorio...")
+                with self.tracer.span('publish'):
+                    self.send_reminder_notification(user_id, email, **notification_data)
+                if self.deadline_aware:
+                    self.record_deadline_outcome(notification_type, **notification_data)
+            elif notification_type == "Offer":
+                print(f"\n🏷️ Enviando oferta...")
+                with self.tracer.span('publish'):
+                    self.send_offer_notification(user_id, email, **notification_data)
+            elif notification_type == "Subscription":
+                print(f"\n📫 Procesando suscripción...")
+                print(f"Subscription processed for {user_id}")
+                
+            print(f"✅ Procesado {notification_type} con prioridad {msg_priority_level}")
+            self.priority_queue.ack(receipt_handle)
+        except Exception as e:
+            print(f"❌ Error procesando notificación: {str(e)}")
+            # Liberar el mensaje de inmediato para que otro worker lo reintente
+            # (o enviarlo a cuarentena si ya agotó sus recepciones)
+            self.priority_queue.release(receipt_handle, error=str(e))
+
+        return (notification_type, msg_priority_level)
+
+    def flush_offer_digests(self, force=False):
+        if not self.offer_coalescer:
+            return 0
+        sent = 0
+        for user_id, beauty_salon_id, group in self.offer_coalescer.pop_due(force=force):
+            # El digest continúa la traza de la primera oferta agrupada
+            trace_context = self.priority_queue.get_trace_context(group['receipts'][0])
+            with self.tracer.span('offer_digest', trace_context, offers=len(group['offers'])):
+                if self._send_offer_digest(user_id, beauty_salon_id, group):
+                    sent += 1
+        return sent
+
+    def _send_offer_digest(self, user_id, beauty_salon_id, group):
+        try:
+            # Una sola verificación de duplicados por digest en lugar de una por oferta
+            with self.tracer.span('dedup_check'):
+                existing = self.check_existing_notification('Offer', user_id, beauty_salon_id=beauty_salon_id)
+            if existing:
+                print(f"⚠️ Digest de ofertas para {user_id} ya fue enviado anteriormente")
+            elif len(group['offers']) == 1:
+                offer = group['offers'][0]
+                with self.tracer.span('publish'):
+                    self.send_offer_notification(
+                        user_id,
+                        group['email'],
+                        beauty_salon_id=beauty_salon_id,
+                        offer_id=offer['offer_id'],
+                        description=offer['description'],
+                        locale=group['locale']
+                    )
+            else:
+                print(f"\n🏷️ Enviando digest con {len(group['offers'])} ofertas a {user_id}...")
+                with self.tracer.span('publish'):
+                    self.send_offer_digest_notification(
+                        user_id,
+                        group['email'],
+                        beauty_salon_id,
+                        group['offers'],
+                        locale=group['locale']
+                    )
+            for receipt_handle in group['receipts']:
+                self.priority_queue.ack(receipt_handle)
+            return not existing
+        except Exception as e:
+            print(f"❌ Error enviando digest de ofertas: {str(e)}")
+            for receipt_handle in group['receipts']:
+                self.priority_queue.release(receipt_handle, error=str(e))
+            return False
+
+    def get_digest_stats(self):
+        if not self.offer_coalescer:
+            return None
+        stats = self.offer_coalescer.get_stats()
+        stats['pending'] = self.offer_coalescer.pending_count()
+        return stats
+
     def send_reminder_notification(self, user_id, email, **data):
         max_retries = 3
         retry_delay = 2  # segundos
@@ -124,7 +355,8 @@ class PriorityNotificationManager(NotificationManager):
                     beauty_salon_id=data.get("beauty_salon_id"),
                     date=data.get("date"),
                     time_str=data.get("time"),  # Agregar esta línea
-                    service=data.get("service")
+                    service=data.get("service"),
+                    locale=data.get("locale")
                 )
                 return  # Salir si el envío fue exitoso
             except Exception as e:
@@ -149,7 +381,8 @@ class PriorityNotificationManager(NotificationManager):
                     email,
                     beauty_salon_id=data.get("beauty_salon_id"),
                     offer_id=data.get("offer_id"),
-                    description=data.get("description")
+                    description=data.get("description"),
+                    locale=data.get("locale")
                 )
                 return  # Salir si el envío fue exitoso
             except Exception as e:
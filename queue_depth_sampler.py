@@ -0,0 +1,85 @@
+from botocore.exceptions import ClientError
+import threading
+import time
+
+class QueueDepthSampler:
+    def __init__(self, sqs_client, queue_urls, refresh_interval=5):
+        self.sqs = sqs_client
+        self.queue_urls = queue_urls  # prioridad -> lista de URLs (shards) de la cola
+        self.refresh_interval = refresh_interval
+        # URL del shard -> {'priority_level', 'visible', 'in_flight', 'sampled_at'}
+        self._depths = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        # Primera muestra síncrona para que las lecturas no empiecen vacías
+        self.refresh()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def refresh(self):
+        for priority_level, urls in self.queue_urls.items():
+            for queue_url in urls:
+                try:
+                    response = self.sqs.get_queue_attributes(
+                        QueueUrl=queue_url,
+                        AttributeNames=['ApproximateNumberOfMessages', 'ApproximateNumberOfMessagesNotVisible']
+                    )
+                    attributes = response['Attributes']
+                    sample = {
+                        'priority_level': priority_level,
+                        'visible': int(attributes.get('ApproximateNumberOfMessages', 0)),
+                        'in_flight': int(attributes.get('ApproximateNumberOfMessagesNotVisible', 0)),
+                        'sampled_at': time.time()
+                    }
+                    with self._lock:
+                        self._depths[queue_url] = sample
+                except ClientError as e:
+                    print(f"Error muestreando la profundidad de la cola {priority_level}: {e}")
+
+    def depth(self, priority_level=None):
+        # Mensajes visibles (pendientes) según la última muestra, sin llamadas a SQS
+        return self._sum('visible', priority_level)
+
+    def in_flight(self, priority_level=None):
+        return self._sum('in_flight', priority_level)
+
+    def shard_depth(self, queue_url):
+        with self._lock:
+            return self._depths.get(queue_url, {}).get('visible', 0)
+
+    def snapshot(self):
+        # prioridad -> {'visible', 'in_flight', 'shards'}
+        result = {}
+        with self._lock:
+            for queue_url, sample in self._depths.items():
+                level = result.setdefault(sample['priority_level'], {'visible': 0, 'in_flight': 0, 'shards': {}})
+                level['visible'] += sample['visible']
+                level['in_flight'] += sample['in_flight']
+                level['shards'][queue_url] = dict(sample)
+        return result
+
+    def _sum(self, field, priority_level):
+        with self._lock:
+            return sum(
+                sample[field] for sample in self._depths.values()
+                if priority_level is None or sample['priority_level'] == priority_level
+            )
+
+    def _run(self):
+        while not self._stop_event.wait(self.refresh_interval):
+            self.refresh()
@@ -0,0 +1,121 @@
+from collections import Counter
+import os
+import signal
+import sys
+import threading
+import time
+
+class SamplingProfiler:
+    def __init__(self, interval=0.01, dump_interval=60, output_path='consumer_profile.folded', max_depth=64):
+        self.interval = interval
+        self.dump_interval = dump_interval
+        # Formato "folded" (una pila por línea con su número de muestras), compatible con
+        # flamegraph.pl y speedscope. '{pid}' se sustituye para separar los procesos
+        self.output_path = output_path
+        self.max_depth = max_depth
+        # pila plegada -> número de muestras
+        self._stacks = Counter()
+        self.samples = 0
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._toggle_requested = threading.Event()
+        self._toggle_thread = None
+
+    def start(self):
+        if self.is_running():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        print(f"🔬 Profiler de muestreo activado (cada {self.interval * 1000:.0f} ms)")
+
+    def stop(self):
+        if not self.is_running():
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+        self.dump()
+        print("🔬 Profiler de muestreo desactivado")
+
+    def toggle(self):
+        if self.is_running():
+            self.stop()
+        else:
+            self.start()
+        return self.is_running()
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def install_signal_toggle(self, signum=None):
+        # Permite activarlo en caliente con `kill -USR2 <pid>` sin reiniciar el consumidor.
+        # El handler solo marca la petición: stop() hace join y vuelca el perfil, y dentro
+        # del handler podría bloquearse con el lock que tiene tomado el hilo interrumpido
+        signum = signum or getattr(signal, 'SIGUSR2', None)
+        if signum is None or threading.current_thread() is not threading.main_thread():
+            return False
+        if self._toggle_thread is None:
+            self._toggle_thread = threading.Thread(target=self._watch_toggle, daemon=True)
+            self._toggle_thread.start()
+        signal.signal(signum, lambda received, frame: self._toggle_requested.set())
+        return True
+
+    def sample(self):
+        own_thread = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        stacks = []
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread:
+                continue
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            stack.append(names.get(thread_id, str(thread_id)))
+            stacks.append(';'.join(reversed(stack)))
+        with self._lock:
+            self._stacks.update(stacks)
+            self.samples += 1
+
+    def top(self, limit=10):
+        with self._lock:
+            return self._stacks.most_common(limit)
+
+    def reset(self):
+        with self._lock:
+            self._stacks.clear()
+            self.samples = 0
+
+    def dump(self, path=None):
+        path = (path or self.output_path).format(pid=os.getpid())
+        with self._lock:
+            stacks = self._stacks.most_common()
+            samples = self.samples
+        with open(path, 'w', encoding='utf-8') as output:
+            for stack, count in stacks:
+                output.write(f"{stack} {count}\n")
+        print(f"📊 Perfil con {samples} muestras volcado en {path}")
+        return path
+
+    def _watch_toggle(self):
+        while True:
+            self._toggle_requested.wait()
+            self._toggle_requested.clear()
+            try:
+                self.toggle()
+            except Exception as e:
+                print(f"❌ Error alternando el profiler: {e}")
+
+    def _run(self):
+        last_dump = time.time()
+        while not self._stop_event.wait(self.interval):
+            self.sample()
+            if self.dump_interval and time.time() - last_dump >= self.dump_interval:
+                try:
+                    self.dump()
+                except OSError as e:
+                    print(f"❌ Error volcando el perfil: {e}")
+                last_dump = time.time()
@@ -1,9 +1,25 @@
 import unittest
 import uuid  # Importar el módulo uuid
 from priority_notification_manager import PriorityNotificationManager, NotificationManager
+from inflight_tracker import InFlightMessageTracker
+from dead_letter_queue import DeadLetterQueue
+from consumer_pool import AutoscalingConsumerPool
+from consumer_supervisor import ConsumerSupervisor
+from message_templates import MessageTemplateRegistry
+from follower_cache import FollowerSetCache
+from offer_coalescer import OfferCoalescer
+from enqueue_spool import EnqueueSpool
+from message_tracer import MessageTracer
+from sampling_profiler import SamplingProfiler
+from botocore.exceptions import ClientError
+import os
+import tempfile
+import signal
+import threading
 import boto3
 from unittest.mock import MagicMock, patch
 import time
+import json
 
 class TestNotificationManagers(unittest.TestCase):
 
@@ -318,6 +334,1001 @@ class TestNotificationManagers(unittest.TestCase):
         self.assertEqual(processed, expected_order)
         print("✅ Orden de prioridad verificado correctamente")
 
+class TestDeadlineAwarePriority(unittest.TestCase):
+
+    def setUp(self):
+        self.priority_manager = PriorityNotificationManager(deadline_aware=True)
+        self.priority_manager.priority_queue.sqs = MagicMock()
+
+    def test_reminder_deadline_routing(self):
+        """Test que los recordatorios cercanos van a 'high' y los lejanos a 'medium'"""
+        now = time.time()
+        self.assertEqual(self.priority_manager.get_priority_level("Reminder", now + 1800), "high")
+        self.assertEqual(self.priority_manager.get_priority_level("Reminder", now + 7 * 86400), "medium")
+        self.assertEqual(self.priority_manager.get_priority_level("Offer"), "medium")
+        self.assertIsNone(self.priority_manager.get_notification_deadline("Offer", date="2024-03-01"))
+        deadline = self.priority_manager.get_notification_deadline("Reminder", date="2024-03-01", time="10:00")
+        self.assertEqual(deadline, 1709287200.0)
+
+    def test_earliest_deadline_first_within_level(self):
+        """Test que dentro de un nivel se entrega primero el deadline más cercano"""
+        queue = self.priority_manager.priority_queue
+        late = ['Reminder', 'late', 'late@example.com', {}]
+        soon = ['Reminder', 'soon', 'soon@example.com', {}]
+        messages = [
+            {'Body': json.dumps({'timestamp': '1', 'data': late, 'deadline': 2000}), 'ReceiptHandle': 'a'},
+            {'Body': json.dumps({'timestamp': '2', 'data': soon, 'deadline': 1000}), 'ReceiptHandle': 'b'},
+        ]
+        queue.sqs.receive_message.side_effect = lambda **kwargs: (
+            {'Messages': messages} if kwargs['QueueUrl'] == 'high-url' else {}
+        )
+        queue.priority_queue_urls = {'high': 'high-url', 'medium': 'medium-url', 'low': 'low-url'}
+
+        self.assertEqual(queue.get(), ('high', soon))
+        messages = []
+        self.assertEqual(queue.get(), ('high', late))
+        queue.sqs.delete_message_batch.assert_called_once()
+
+    def test_buffered_messages_are_returned_on_drain(self):
+        """Test que al drenar se devuelven a SQS los mensajes que quedaron en el buffer EDF"""
+        queue = self.priority_manager.priority_queue
+        queue.priority_queue_urls = {'high': 'high-url', 'medium': 'medium-url', 'low': 'low-url'}
+        bodies = [json.dumps({'timestamp': str(i), 'data': ['Reminder', f'u{i}', 'u@example.com', {}], 'deadline': i})
+                  for i in range(3)]
+        queue.sqs.receive_message.side_effect = lambda **kwargs: (
+            {'Messages': [{'Body': body, 'ReceiptHandle': f'r{i}'} for i, body in enumerate(bodies)]}
+            if kwargs['QueueUrl'] == 'high-url' else {}
+        )
+        self.assertEqual(queue.receive()[2], 'r0')
+        queue.sqs.receive_message.side_effect = None
+
+        self.assertEqual(queue.release_buffered(), 2)
+        resent = [call.kwargs['MessageBody'] for call in queue.sqs.send_message.call_args_list]
+        self.assertEqual(resent, bodies[1:])
+        self.assertFalse(any(queue._deadline_buffers.values()))
+
+    def test_late_reminders_are_counted(self):
+        """Test del contador de notificaciones enviadas después de su deadline"""
+        self.priority_manager.record_deadline_outcome("Reminder", date="2000-01-01", time="10:00")
+        self.priority_manager.record_deadline_outcome("Reminder", date="2999-01-01", time="10:00")
+        self.assertEqual(self.priority_manager.get_deadline_stats(), {'on_time': 1, 'late': 1})
+
+    def test_deadline_uses_the_appointment_timezone(self):
+        """Test que la hora local de la cita se convierte con la zona horaria configurada"""
+        self.priority_manager.appointment_timezone = 'America/Bogota'
+        deadline = self.priority_manager.get_notification_deadline("Reminder", date="2024-03-01", time="10:00")
+        self.assertEqual(deadline, 1709287200.0 + 5 * 3600)
+        deadline = self.priority_manager.get_notification_deadline(
+            "Reminder", date="2024-03-01", time="10:00", timezone="Europe/Madrid")
+        self.assertEqual(deadline, 1709287200.0 - 3600)
+
+    def test_refill_does_not_block_other_workers(self):
+        """Test que un worker esperando a SQS no bloquea a otro que puede tomar del buffer"""
+        queue = self.priority_manager.priority_queue
+        queue.priority_queue_urls = {'high': 'high-url', 'medium': 'medium-url', 'low': 'low-url'}
+        queue._deadline_buffers['high'].append((1000, '1', 0, ['Reminder', 'u', 'u@example.com', {}], 'buffered'))
+        release_poll = threading.Event()
+        calls = []
+        def receive_message(**kwargs):
+            calls.append(kwargs['QueueUrl'])
+            if len(calls) == 1:
+                release_poll.wait(5)  # El primer worker queda esperando a SQS
+            return {}
+        queue.sqs.receive_message.side_effect = receive_message
+
+        waiting_worker = threading.Thread(target=queue.receive)
+        waiting_worker.start()
+        while not calls:
+            time.sleep(0.01)
+        self.assertEqual(queue.receive()[2], 'buffered')
+        self.assertFalse(release_poll.is_set())
+        release_poll.set()
+        waiting_worker.join()
+
+class TestInFlightMessageTracker(unittest.TestCase):
+
+    def setUp(self):
+        self.sqs = MagicMock()
+        self.tracker = InFlightMessageTracker(self.sqs, heartbeat_interval=10, min_samples=5)
+
+    def tearDown(self):
+        self.tracker.stop()
+
+    def test_initial_timeout_from_percentiles(self):
+        """Test que el timeout inicial se calcula a partir del percentil observado"""
+        self.assertEqual(self.tracker.initial_timeout(), 30)
+        self.tracker._durations.extend([10, 10, 10, 10, 40])
+        self.assertEqual(self.tracker.initial_timeout(), 60)
+
+    def test_extension_outlasts_the_next_heartbeat(self):
+        """Test que en una cola rápida la extensión cubre varios latidos y no vence en el límite"""
+        self.tracker._durations.extend([1, 1, 1, 1, 1])
+        self.assertGreaterEqual(self.tracker.initial_timeout(), 3 * self.tracker.heartbeat_interval)
+
+        self.sqs.change_message_visibility_batch.return_value = {}
+        self.tracker.track('queue-url', 'slow', 5)
+        self.tracker.heartbeat()
+        entry = self.sqs.change_message_visibility_batch.call_args.kwargs['Entries'][0]
+        self.assertEqual(entry['VisibilityTimeout'], 30)
+
+    def test_heartbeat_extends_in_batches(self):
+        """Test que los heartbeats extienden la visibilidad en lotes de 10"""
+        self.sqs.change_message_visibility_batch.return_value = {'Failed': [{'Id': '0'}]}
+        for i in range(12):
+            self.tracker.track('queue-url', f'handle-{i}', 5)
+        self.tracker.heartbeat()
+
+        self.assertEqual(self.sqs.change_message_visibility_batch.call_count, 2)
+        self.assertEqual(self.tracker.stats['lost'], 2)
+        self.assertEqual(self.tracker.in_flight_count(), 10)
+
+    def test_release_and_complete(self):
+        """Test que un fallo libera el mensaje y un éxito lo elimina"""
+        self.tracker.track('queue-url', 'ok', 30)
+        self.tracker.track('queue-url', 'failed', 30)
+        self.tracker.complete('ok')
+        self.tracker.release('failed')
+
+        self.sqs.delete_message.assert_called_once_with(QueueUrl='queue-url', ReceiptHandle='ok')
+        self.sqs.change_message_visibility.assert_called_once_with(
+            QueueUrl='queue-url', ReceiptHandle='failed', VisibilityTimeout=0
+        )
+        self.assertEqual(self.tracker.in_flight_count(), 0)
+
+class TestPoisonMessages(unittest.TestCase):
+
+    def setUp(self):
+        self.priority_manager = PriorityNotificationManager(track_in_flight=True)
+        self.queue = self.priority_manager.priority_queue
+        self.queue.sqs = MagicMock()
+        self.queue.inflight_tracker.sqs = self.queue.sqs
+        self.queue.priority_queue_urls = {'high': 'high-url', 'medium': 'medium-url', 'low': 'low-url'}
+        self.queue.dead_letter_queue = DeadLetterQueue(self.queue.sqs, 'dlq-url')
+        self.queue.max_receive_count = 3
+
+    def tearDown(self):
+        self.queue.inflight_tracker.stop()
+
+    def _message(self, body, receipt_handle, receive_count=1):
+        return {
+            'Body': body,
+            'ReceiptHandle': receipt_handle,
+            'Attributes': {'ApproximateReceiveCount': str(receive_count)}
+        }
+
+    def test_poison_messages_are_quarantined(self):
+        """Test que los mensajes indecodificables o con demasiadas recepciones van a cuarentena"""
+        valid = ['Offer', 'user', 'user@example.com', {'beauty_salon_id': 'salon'}]
+        responses = [
+            {'Messages': [self._message('not json', 'broken')]},
+            {'Messages': [self._message(json.dumps({'data': ['Offer']}), 'malformed')]},
+            {'Messages': [self._message(json.dumps({'data': valid}), 'exhausted', receive_count=4)]},
+            {'Messages': [self._message(json.dumps({'data': valid}), 'valid')]},
+        ]
+        self.queue.sqs.receive_message.side_effect = responses
+
+        self.assertEqual(self.queue.receive(), ('high', valid, 'valid'))
+        self.assertEqual(self.queue.dead_letter_queue.stats['quarantined'], 3)
+        reasons = [
+            json.loads(call.kwargs['MessageBody'])['reason']
+            for call in self.queue.sqs.send_message.call_args_list
+        ]
+        self.assertEqual(reasons, ['decode_error', 'decode_error', 'max_receives_exceeded'])
+        self.assertEqual(self.queue.sqs.delete_message.call_count, 3)
+
+    def test_poison_message_is_kept_when_quarantine_fails(self):
+        """Test que un mensaje venenoso no se elimina de su cola si no se pudo enviar a cuarentena"""
+        self.queue.sqs.receive_message.side_effect = [{'Messages': [self._message('not json', 'r1')]}, {}]
+        self.queue.sqs.send_message.side_effect = ClientError(
+            {'Error': {'Code': 'ServiceUnavailable', 'Message': 'DLQ caída'}}, 'SendMessage')
+
+        self.assertIsNone(self.queue._receive_from_shard('high', 'high-url', long_poll=False))
+        self.queue.sqs.delete_message.assert_not_called()
+
+        self.queue.sqs.receive_message.side_effect = [{'Messages': [self._message('not json', 'r2')]}, {}]
+        self.queue.sqs.send_message.side_effect = None
+        self.queue._receive_from_shard('high', 'high-url', long_poll=False)
+        self.queue.sqs.delete_message.assert_called_once_with(QueueUrl='high-url', ReceiptHandle='r2')
+
+    def test_failure_after_last_receive_goes_to_dead_letter_queue(self):
+        """Test que un fallo en la última recepción permitida envía el mensaje a cuarentena"""
+        valid = ['Offer', 'user', 'user@example.com', {'beauty_salon_id': 'salon'}]
+        self.queue.sqs.receive_message.return_value = {
+            'Messages': [self._message(json.dumps({'data': valid}), 'last', receive_count=3)]
+        }
+        _, _, receipt_handle = self.queue.receive()
+        self.queue.release(receipt_handle, error='boom')
+
+        quarantined = json.loads(self.queue.sqs.send_message.call_args.kwargs['MessageBody'])
+        self.assertEqual(quarantined['reason'], 'processing_failed')
+        self.assertEqual(quarantined['error'], 'boom')
+        self.assertEqual(quarantined['source_queue_url'], 'high-url')
+        self.queue.sqs.change_message_visibility.assert_not_called()
+        self.assertEqual(self.queue.inflight_tracker.in_flight_count(), 0)
+
+    def test_replay_dead_letters(self):
+        """Test que el re-envío devuelve los mensajes a su cola de origen en lote"""
+        entry = {'source_queue_url': 'high-url', 'priority_level': 'high', 'original_body': '{"data": []}'}
+        self.queue.sqs.receive_message.side_effect = [
+            {'Messages': [{'Body': json.dumps(entry), 'ReceiptHandle': f'dlq-{i}'} for i in range(2)]},
+            {}
+        ]
+        self.queue.sqs.send_message_batch.return_value = {'Successful': [{'Id': '0'}, {'Id': '1'}]}
+
+        self.assertEqual(self.queue.replay_dead_letters(), 2)
+        self.queue.sqs.send_message_batch.assert_called_once()
+        self.assertEqual(self.queue.sqs.send_message_batch.call_args.kwargs['QueueUrl'], 'high-url')
+        self.queue.sqs.delete_message_batch.assert_called_once()
+
+    def test_replay_skips_messages_not_written_by_quarantine(self):
+        """Test que el re-envío deja en la cola de mensajes muertos los mensajes ajenos sin abortar"""
+        entry = {'source_queue_url': 'high-url', 'priority_level': 'high', 'original_body': '{"data": []}'}
+        self.queue.sqs.receive_message.side_effect = [
+            {'Messages': [
+                {'Body': 'not json', 'ReceiptHandle': 'dlq-0'},
+                {'Body': json.dumps({'data': []}), 'ReceiptHandle': 'dlq-1'},
+                {'Body': json.dumps(entry), 'ReceiptHandle': 'dlq-2'}
+            ]},
+            {}
+        ]
+        self.queue.sqs.send_message_batch.return_value = {'Successful': [{'Id': '0'}]}
+
+        self.assertEqual(self.queue.replay_dead_letters(), 1)
+        self.assertEqual(self.queue.dead_letter_queue.stats['unreplayable'], 2)
+        deleted = self.queue.sqs.delete_message_batch.call_args.kwargs['Entries']
+        self.assertEqual([item['ReceiptHandle'] for item in deleted], ['dlq-2'])
+
+    def test_fifo_quarantine_and_replay_keep_group_and_attributes(self):
+        """Test que con colas FIFO la cuarentena y el re-envío llevan grupo, id de deduplicación nuevo y atributos"""
+        dead_letters = DeadLetterQueue(self.queue.sqs, 'dlq.fifo')
+        traceparent = {'traceparent': {'DataType': 'String', 'StringValue': '00-abc-def-01'}}
+        dead_letters.quarantine('high.fifo', 'high', '{"data": []}', 'processing_failed',
+                                group_id='user-1', message_attributes=traceparent)
+        sent = self.queue.sqs.send_message.call_args.kwargs
+        self.assertEqual(sent['MessageGroupId'], 'user-1')
+        self.assertIn('MessageDeduplicationId', sent)
+
+        self.queue.sqs.receive_message.side_effect = [{'Messages': [{'Body': sent['MessageBody'], 'ReceiptHandle': 'dlq-0'}]}, {}]
+        self.queue.sqs.send_message_batch.return_value = {'Successful': [{'Id': '0'}]}
+        dead_letters.replay()
+        replayed = self.queue.sqs.send_message_batch.call_args.kwargs['Entries'][0]
+        self.assertEqual(replayed['MessageGroupId'], 'user-1')
+        self.assertEqual(replayed['MessageAttributes'], traceparent)
+        self.assertNotEqual(replayed['MessageDeduplicationId'], sent['MessageDeduplicationId'])
+
+class TestQueueDepthAutoscaling(unittest.TestCase):
+
+    def setUp(self):
+        self.priority_manager = PriorityNotificationManager()
+        self.queue = self.priority_manager.priority_queue
+        self.queue.sqs = MagicMock()
+        self.queue.priority_queue_urls = {'high': 'high-url', 'medium': 'medium-url', 'low': 'low-url'}
+        self.depths = {'high-url': 0, 'medium-url': 0, 'low-url': 0}
+        self.queue.sqs.get_queue_attributes.side_effect = lambda QueueUrl, AttributeNames: {
+            'Attributes': {
+                'ApproximateNumberOfMessages': str(self.depths[QueueUrl]),
+                'ApproximateNumberOfMessagesNotVisible': '0'
+            }
+        }
+
+    def tearDown(self):
+        self.queue.stop_depth_sampler()
+
+    def test_empty_reads_cached_depth(self):
+        """Test que empty() usa la profundidad en caché sin llamar a SQS"""
+        self.depths['medium-url'] = 4
+        sampler = self.queue.start_depth_sampler(refresh_interval=60)
+        calls = self.queue.sqs.get_queue_attributes.call_count
+
+        self.assertFalse(self.queue.empty())
+        self.assertEqual(sampler.depth('medium'), 4)
+        self.assertEqual(sampler.depth(), 4)
+        self.assertEqual(self.queue.sqs.get_queue_attributes.call_count, calls)
+
+    def test_pool_scales_with_backlog_and_hysteresis(self):
+        """Test que el pool crece con el backlog y se reduce solo tras varias evaluaciones"""
+        pool = AutoscalingConsumerPool(self.priority_manager, min_workers=1, max_workers=4,
+                                       target_drain_seconds=10, scale_down_after=2)
+        pool._resize = lambda target: setattr(pool, '_workers', [None] * target)
+        pool._last_evaluation = time.time()
+        self.queue.start_depth_sampler(refresh_interval=60)
+        pool._workers = [None]
+
+        pool.drain_rate = 1.0
+        self.assertEqual(pool.desired_workers(25, 1), 3)
+        self.assertEqual(pool.desired_workers(1000, 1), 4)
+
+        self.depths['high-url'] = 25
+        self.queue.depth_sampler.refresh()
+        pool.evaluate()
+        self.assertGreater(pool.worker_count(), 1)
+        pool._workers = [None] * 3
+
+        self.depths['high-url'] = 0
+        self.queue.depth_sampler.refresh()
+        pool.evaluate()
+        self.assertEqual(pool.worker_count(), 3)
+        pool.evaluate()
+        self.assertEqual(pool.worker_count(), 2)
+
+    def test_idle_intervals_do_not_skew_drain_rate(self):
+        """Test que la tasa de drenado ignora intervalos ociosos y que stop() detiene el muestreo"""
+        pool = AutoscalingConsumerPool(self.priority_manager, min_workers=1, max_workers=4, scale_interval=60)
+        pool._resize = lambda target: setattr(pool, '_workers', [None] * target)
+        self.priority_manager.flush_offer_digests = MagicMock()
+        self.priority_manager.flush_diagnostics = MagicMock()
+        pool.start()
+        self.assertTrue(self.queue.depth_sampler.is_running())
+
+        pool.drain_rate = 5.0
+        pool._processed, pool._empty_polls = 1, 3
+        pool.evaluate()
+        self.assertEqual(pool.drain_rate, 5.0)
+
+        pool.stop()
+        self.assertFalse(self.queue.depth_sampler.is_running())
+
+class TestShardedQueues(unittest.TestCase):
+
+    def setUp(self):
+        self.queue = PriorityNotificationManager().priority_queue
+        self.queue.sqs = MagicMock()
+        self.queue.priority_queue_urls = {
+            'high': ['high-0', 'high-1', 'high-2'],
+            'medium': 'medium-url',
+            'low': 'low-url'
+        }
+
+    def test_put_keeps_user_on_same_shard(self):
+        """Test que los mensajes de un usuario siempre van al mismo shard"""
+        for _ in range(3):
+            self.queue.put('high', ['Reminder', 'user-a', 'a@example.com', {}], shard_key='user-a')
+        urls = {call.kwargs['QueueUrl'] for call in self.queue.sqs.send_message.call_args_list}
+        self.assertEqual(len(urls), 1)
+        shards = {self.queue.get_queue_url('high', f'user-{i}') for i in range(50)}
+        self.assertEqual(shards, {'high-0', 'high-1', 'high-2'})
+
+    def test_receive_round_robin_and_empty_covers_all_shards(self):
+        """Test que la lectura rota entre shards y empty()/purge() cubren todos"""
+        self.queue.sqs.receive_message.return_value = {}
+        self.queue.get()
+        self.queue.get()
+        polled = [call.kwargs['QueueUrl'] for call in self.queue.sqs.receive_message.call_args_list]
+        self.assertEqual(polled[:3], ['high-0', 'high-1', 'high-2'])
+        self.assertEqual(polled[5:8], ['high-1', 'high-2', 'high-0'])
+
+        self.queue.sqs.get_queue_attributes.return_value = {'Attributes': {'ApproximateNumberOfMessages': '0'}}
+        self.assertTrue(self.queue.empty())
+        self.assertEqual(self.queue.sqs.get_queue_attributes.call_count, 5)
+        with patch('time.sleep'):
+            self.queue.purge()
+        self.assertEqual(self.queue.sqs.purge_queue.call_count, 5)
+
+class TestFifoQueueMode(unittest.TestCase):
+
+    def setUp(self):
+        self.priority_manager = PriorityNotificationManager()
+        self.queue = self.priority_manager.priority_queue
+        self.queue.sqs = MagicMock()
+        self.queue.priority_queue_urls = {'high': 'high.fifo', 'medium': 'medium.fifo', 'low': 'low.fifo'}
+        self.queue.fifo = True
+        self.priority_manager.dynamodb = MagicMock()
+
+    def test_fifo_enqueue_uses_broker_deduplication(self):
+        """Test que en modo FIFO se envía grupo y deduplicación sin consultar DynamoDB"""
+        data = {'beauty_salon_id': 'salon-1', 'offer_id': 'offer-1', 'description': '50%'}
+        self.priority_manager.add_notification_to_queue('Offer', 'user-1', 'user@example.com', **data)
+        self.priority_manager.add_notification_to_queue('Offer', 'user-1', 'user@example.com', **dict(reversed(list(data.items()))))
+
+        self.priority_manager.dynamodb.query.assert_not_called()
+        first, second = [call.kwargs for call in self.queue.sqs.send_message.call_args_list]
+        self.assertEqual(first['MessageGroupId'], 'user-1')
+        self.assertEqual(first['MessageDeduplicationId'], second['MessageDeduplicationId'])
+        self.assertNotIn('DelaySeconds', first)
+
+        self.priority_manager.fifo_group_by = 'salon'
+        self.priority_manager.add_notification_to_queue('Offer', 'user-1', 'user@example.com', offer_id='offer-2', **{'beauty_salon_id': 'salon-1'})
+        third = self.queue.sqs.send_message.call_args.kwargs
+        self.assertEqual(third['MessageGroupId'], 'salon-1')
+        self.assertNotEqual(third['MessageDeduplicationId'], first['MessageDeduplicationId'])
+
+    def test_salon_groups_stay_on_one_shard(self):
+        """Test que al agrupar por salón todos los mensajes del grupo van al mismo shard FIFO"""
+        self.queue.priority_queue_urls['medium'] = ['medium-0.fifo', 'medium-1.fifo', 'medium-2.fifo']
+        self.priority_manager.fifo_group_by = 'salon'
+        for i in range(20):
+            self.priority_manager.add_notification_to_queue('Offer', f'user-{i}', 'user@example.com',
+                                                            beauty_salon_id='salon-1', offer_id='offer-1')
+        sent = [call.kwargs for call in self.queue.sqs.send_message.call_args_list]
+        self.assertEqual({params['MessageGroupId'] for params in sent}, {'salon-1'})
+        self.assertEqual(len({params['QueueUrl'] for params in sent}), 1)
+
+class FakeConsumerQueue:
+    def __init__(self, messages):
+        self.messages = messages
+
+    def receive(self):
+        if self.messages == 0:
+            time.sleep(0.05)
+            return None
+        self.messages -= 1
+        return ('low', ['Subscription', 'user', 'user@example.com', {}], None)
+
+    def release(self, receipt_handle, error=None):
+        pass
+
+    def release_buffered(self):
+        return 0
+
+class FakeConsumerManager:
+    # Usa el mismo bucle de consumo que el manager real
+    consume_once = PriorityNotificationManager.consume_once
+
+    def __init__(self):
+        self.priority_queue = FakeConsumerQueue(messages=5)
+
+    def process_message(self, message):
+        return (message[1][0], message[0])
+
+    def flush_offer_digests(self, force=False):
+        return 0
+
+    def flush_diagnostics(self):
+        pass
+
+class TestConsumerSupervisor(unittest.TestCase):
+
+    def test_supervisor_aggregates_stats_and_drains(self):
+        """Test que el supervisor agrega las estadísticas de cada proceso y drena al terminar"""
+        supervisor = ConsumerSupervisor(processes=2, manager_factory=FakeConsumerManager,
+                                        report_interval=0.2, drain_timeout=10)
+        supervisor.start()
+        deadline = time.time() + 30
+        while supervisor.stats['processed'] < 10 and time.time() < deadline:
+            supervisor.collect_stats(timeout=0.5)
+            supervisor.check_workers()
+        supervisor.drain()
+
+        self.assertEqual(supervisor.stats['processed'], 10)
+        self.assertEqual(set(supervisor.stats['workers']), {0, 1})
+        self.assertEqual(supervisor.stats['restarts'], 0)
+        self.assertFalse(any(process.is_alive() for process in supervisor._workers.values()))
+
+    def test_pool_and_supervisor_share_the_consume_step(self):
+        """Test que consume_once procesa, libera los fallidos y envía digests con la cola vacía"""
+        manager = FakeConsumerManager()
+        manager.priority_queue = MagicMock()
+        manager.flush_offer_digests = MagicMock()
+        manager.priority_queue.receive.side_effect = [('low', ['Subscription'], 'r1'), ('low', ['Offer'], 'r2'), None]
+        manager.process_message = MagicMock(side_effect=[None, Exception('SNS caído')])
+
+        self.assertIs(manager.consume_once(), True)
+        self.assertIs(manager.consume_once(), False)
+        manager.priority_queue.release.assert_called_once_with('r2', error='SNS caído')
+        self.assertIsNone(manager.consume_once())
+        manager.flush_offer_digests.assert_called_once_with()
+
+        pool = AutoscalingConsumerPool(manager)
+        stop_event = threading.Event()
+        outcomes = [True, True, False, None]
+
+        def consume_once():
+            if len(outcomes) == 1:
+                stop_event.set()
+            return outcomes.pop(0)
+        manager.consume_once = consume_once
+        pool._worker_loop(stop_event)
+        self.assertEqual((pool.stats['processed'], pool.stats['failed'], pool._empty_polls), (2, 1, 1))
+
+class TestMessageTemplates(unittest.TestCase):
+
+    def test_default_templates_match_previous_messages(self):
+        """Test que las plantillas por defecto producen los mensajes originales"""
+        registry = MessageTemplateRegistry()
+        subject, body = registry.render('Reminder', 'salon-1', user_id='user-1', date='2024-03-01', time='10:00', service='Corte')
+        self.assertEqual(subject, "Appointment Reminder")
+        self.assertEqual(body, "Hello user-1,\n\nThis is a reminder for your appointment at beauty salon salon-1 on 2024-03-01 at 10:00 for Corte.")
+
+    def test_salon_and_locale_resolution_with_lru_cache(self):
+        """Test de la resolución por salón/locale, el renderizado en lote y la expulsión LRU"""
+        registry = MessageTemplateRegistry(max_cached=2)
+        registry.register('Offer', "Oferta", "Hola {user_id}: {description}", locale='es')
+        registry.register('Offer', "Oferta VIP", "Hola {user_id}, {beauty_salon_id}: {description}", beauty_salon_id='vip', locale='es')
+
+        self.assertEqual(registry.render('Offer', 'vip', 'es', user_id='u', description='d'), ("Oferta VIP", "Hola u, vip: d"))
+        self.assertEqual(registry.render('Offer', 'otro', 'es', user_id='u', description='d'), ("Oferta", "Hola u: d"))
+        self.assertEqual(registry.render('Offer', 'otro', 'fr', user_id='u')[0], "New Offer Available")
+        self.assertEqual(registry.stats['evictions'], 1)
+
+        rendered = registry.render_many('Offer', [{'user_id': 'a'}, {'user_id': 'b'}], 'vip', 'es')
+        self.assertEqual([body for _, body in rendered], ["Hola a, vip: ", "Hola b, vip: "])
+        with self.assertRaises(ValueError):
+            registry.register('Offer', "{user.id}", "body")
+
+    def test_salons_sharing_a_template_share_the_compiled_copy(self):
+        """Test que los salones que usan la plantilla por defecto no ocupan cada uno una entrada de la caché"""
+        registry = MessageTemplateRegistry(max_cached=2)
+        for i in range(100):
+            registry.render('Offer', f'salon-{i}', 'es', user_id='u', description='d')
+        self.assertEqual(registry.stats['misses'], 1)
+        self.assertEqual(registry.stats['evictions'], 0)
+
+        registry.register('Offer', "Oferta", "Hola {user_id}", beauty_salon_id='salon-7')
+        self.assertEqual(registry.render('Offer', 'salon-7', 'es', user_id='u'), ("Oferta", "Hola u"))
+        self.assertEqual(registry.render('Offer', 'salon-8', 'es', user_id='u')[0], "New Offer Available")
+
+class TestPendingIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.manager = NotificationManager()
+        self.manager.dynamodb = MagicMock()
+
+    def _item(self, user_id):
+        return {
+            'UserID_TypeBehavior_BeautySalonID': {'S': f'{user_id}#Subscription#salon-1'},
+            'Email': {'S': f'{user_id}@example.com'}
+        }
+
+    def test_pending_reads_are_paginated_and_report_capacity(self):
+        """Test que la lectura del índice disperso recorre todas las páginas y reporta RCU"""
+        self.manager.dynamodb.query.side_effect = [
+            {'Items': [self._item('a'), self._item('b')], 'LastEvaluatedKey': {'k': 'b'}, 'ConsumedCapacity': {'CapacityUnits': 0.5}},
+            {'Items': [self._item('c')], 'ConsumedCapacity': {'CapacityUnits': 0.5}},
+        ]
+        items = self.manager.get_recent_notifications_by_type_and_salon('Subscription', 'salon-1')
+
+        self.assertEqual(len(items), 3)
+        first_call, second_call = [call.kwargs for call in self.manager.dynamodb.query.call_args_list]
+        self.assertEqual(first_call['IndexName'], self.manager.pending_index_name)
+        self.assertNotIn('FilterExpression', first_call)
+        self.assertEqual(second_call['ExclusiveStartKey'], {'k': 'b'})
+        self.assertAlmostEqual(self.manager.get_read_capacity_per_item(), 1 / 3)
+
+    def test_status_transition_leaves_the_pending_index(self):
+        """Test que al pasar a 'Enviado' el item sale del índice disperso"""
+        self.manager.dynamodb.query.return_value = {'Items': [{'Timestamp': {'S': 't'}}]}
+        self.manager.update_notification_status('user', 'Offer', 'salon-1', 'Enviado')
+        update = self.manager.dynamodb.update_item.call_args.kwargs
+        self.assertEqual(update['UpdateExpression'], 'SET #s = :status REMOVE PendingTypeSalon')
+
+        self.manager.update_notifications('user', 'user@example.com', 'Offer', 'salon-1', offer_id='o')
+        item = self.manager.dynamodb.put_item.call_args.kwargs['Item']
+        self.assertEqual(item['PendingTypeSalon'], {'S': 'Offer#salon-1'})
+
+    def test_backfill_adds_existing_pending_items_to_the_index(self):
+        """Test que el backfill añade PendingTypeSalon a los items pendientes escritos antes del índice"""
+        def item(user_id):
+            return {'UserID_TypeBehavior_BeautySalonID': {'S': f'{user_id}#Subscription#salon-1'},
+                    'Timestamp': {'S': 't'}, 'BeautySalonID': {'S': 'salon-1'}}
+        self.manager.dynamodb.scan.side_effect = [
+            {'Items': [item('a')], 'LastEvaluatedKey': {'k': 'a'}},
+            {'Items': [item('b')]},
+        ]
+        self.manager.dynamodb.update_item.side_effect = [
+            {},
+            ClientError({'Error': {'Code': 'ConditionalCheckFailedException', 'Message': 'ya enviado'}}, 'UpdateItem')
+        ]
+        self.assertEqual(self.manager.backfill_pending_index(), 1)
+        update = self.manager.dynamodb.update_item.call_args_list[0].kwargs
+        self.assertEqual(update['ExpressionAttributeValues'][':key'], {'S': 'Subscription#salon-1'})
+        self.assertEqual(self.manager.dynamodb.scan.call_args_list[1].kwargs['ExclusiveStartKey'], {'k': 'a'})
+
+    def _shard_config(self, salon, shards, previous=None):
+        # Items de configuración con el K persistido de cada salón (put_item los actualiza)
+        self.manager.per_salon_write_shards = True
+        store = {f'config#WriteShards#{salon}': {'Shards': {'N': str(shards)}}}
+        if previous is not None:
+            store[f'config#WriteShards#{salon}'].update(PreviousShards={'N': str(previous)}, ReshardStartedAt={'N': '0'})
+
+        def get_item(**kwargs):
+            item = store.get(kwargs['Key']['UserID_TypeBehavior_BeautySalonID']['S'])
+            return {'Item': item} if item else {}
+
+        def put_item(**kwargs):
+            key = kwargs['Item']['UserID_TypeBehavior_BeautySalonID']['S']
+            if key.startswith('config#'):
+                store[key] = kwargs['Item']
+        self.manager.dynamodb.get_item.side_effect = get_item
+        self.manager.dynamodb.put_item.side_effect = put_item
+        return store
+
+    def test_write_sharded_salon_scatter_gather(self):
+        """Test que un salón con K shards reparte las escrituras y las lecturas se mezclan"""
+        self._shard_config('salon-1', 3)
+        keys = {self.manager.pending_index_key('Subscription', 'salon-1', f'user-{i}') for i in range(30)}
+        self.assertEqual(keys, {f'Subscription#salon-1#{shard}' for shard in range(3)})
+
+        def query(**kwargs):
+            shard = int(kwargs['ExpressionAttributeValues'][':pending']['S'].split('#')[-1])
+            return {'Items': [{'Timestamp': {'S': f'2024-0{shard + 1}'}}, {'Timestamp': {'S': f'2024-0{shard + 4}'}}]}
+        self.manager.dynamodb.query.side_effect = query
+
+        items = list(self.manager.iter_pending_notifications('Subscription', 'salon-1'))
+        self.assertEqual([item['Timestamp']['S'] for item in items], [f'2024-0{i}' for i in range(1, 7)])
+        self.assertEqual(self.manager.dynamodb.query.call_count, 3)
+        self.assertEqual(self.manager.pending_index_key('Subscription', 'other-salon', 'user-1'), 'Subscription#other-salon')
+        # K se lee una vez por salón y se cachea
+        self.assertEqual(self.manager.dynamodb.get_item.call_count, 2)
+
+    def test_scatter_gather_reads_pages_lazily(self):
+        """Test que el merge de shards pide la página siguiente solo cuando la necesita"""
+        self._shard_config('salon-1', 2)
+
+        def query(**kwargs):
+            shard = kwargs['ExpressionAttributeValues'][':pending']['S'].split('#')[-1]
+            if 'ExclusiveStartKey' in kwargs:
+                return {'Items': [{'Timestamp': {'S': f'2024-0{int(shard) + 3}'}}]}
+            return {'Items': [{'Timestamp': {'S': f'2024-0{int(shard) + 1}'}}], 'LastEvaluatedKey': {'k': shard}}
+        self.manager.dynamodb.query.side_effect = query
+
+        items = self.manager.iter_pending_notifications('Subscription', 'salon-1')
+        self.assertEqual(next(items)['Timestamp']['S'], '2024-01')
+        self.assertEqual(self.manager.dynamodb.query.call_count, 2)
+        self.assertEqual([item['Timestamp']['S'] for item in items], ['2024-02', '2024-03', '2024-04'])
+        self.assertEqual(self.manager.dynamodb.query.call_count, 4)
+
+    def test_reshard_reads_old_suffixes_and_moves_items(self):
+        """Test que durante un reshard se leen los sufijos viejos y al terminar se mueven los items"""
+        store = self._shard_config('salon-1', 1)
+        self.assertTrue(self.manager.set_salon_write_shards('salon-1', 2))
+        self.assertEqual(
+            self.manager.pending_partition_keys('Subscription', 'salon-1'),
+            ['Subscription#salon-1#0', 'Subscription#salon-1#1', 'Subscription#salon-1']
+        )
+        # Un segundo reshard antes de terminar el primero dejaría items sin leer
+        with self.assertRaises(ValueError):
+            self.manager.set_salon_write_shards('salon-1', 4)
+        # Terminar antes de que expire la caché de los demás procesos exige esperar explícitamente
+        with self.assertRaises(ValueError):
+            self.manager.finish_salon_reshard('salon-1')
+
+        def query(**kwargs):
+            if kwargs['ExpressionAttributeValues'][':pending']['S'] == 'Subscription#salon-1':
+                return {'Items': [
+                    {'UserID_TypeBehavior_BeautySalonID': {'S': f'user-{i}#Subscription#salon-1'}, 'Timestamp': {'S': str(i)}}
+                    for i in range(10)
+                ]}
+            return {'Items': []}
+        self.manager.dynamodb.query.side_effect = query
+
+        self.manager.write_shards_ttl = 0
+        moved = self.manager.finish_salon_reshard('salon-1')
+        self.assertEqual(moved, self.manager.dynamodb.update_item.call_count)
+        self.assertEqual(moved, 10)
+        for call in self.manager.dynamodb.update_item.call_args_list:
+            values = call.kwargs['ExpressionAttributeValues']
+            self.assertEqual(values[':old'], {'S': 'Subscription#salon-1'})
+            self.assertIn(values[':new']['S'], ('Subscription#salon-1#0', 'Subscription#salon-1#1'))
+
+        self.assertEqual(store['config#WriteShards#salon-1']['Shards'], {'N': '2'})
+        self.assertNotIn('PreviousShards', store['config#WriteShards#salon-1'])
+        self.assertEqual(self.manager.pending_partition_keys('Subscription', 'salon-1'),
+                         ['Subscription#salon-1#0', 'Subscription#salon-1#1'])
+
+    def test_default_k_does_not_read_config_and_survives_config_errors(self):
+        """Test que sin K por salón no se lee configuración y que un fallo al leerla no impide escribir"""
+        self.manager.update_notifications('a', 'a@example.com', 'Subscription', 'salon-1')
+        self.manager.dynamodb.get_item.assert_not_called()
+
+        self.manager.per_salon_write_shards = True
+        self.manager.dynamodb.get_item.side_effect = ClientError(
+            {'Error': {'Code': 'ProvisionedThroughputExceededException', 'Message': 'throttled'}}, 'GetItem')
+        self.manager.update_notifications('b', 'b@example.com', 'Subscription', 'salon-1')
+        item = self.manager.dynamodb.put_item.call_args.kwargs['Item']
+        self.assertEqual(item['PendingTypeSalon'], {'S': 'Subscription#salon-1'})
+
+        self.manager.write_shards_cache_size = 2
+        for salon in ('salon-2', 'salon-3', 'salon-4'):
+            self.manager.get_salon_write_shards(salon)
+        self.assertEqual(list(self.manager._write_shards_cache), ['salon-3', 'salon-4'])
+
+class TestFollowerSetCache(unittest.TestCase):
+
+    def setUp(self):
+        self.manager = NotificationManager()
+        self.manager.dynamodb = MagicMock()
+        self.manager.sns_client = MagicMock()
+        self.manager.dynamodb.query.return_value = {'Items': [
+            {'UserID_TypeBehavior_BeautySalonID': {'S': 'a#Subscription#salon-1'}, 'Timestamp': {'S': 't1'}, 'Email': {'S': 'a@example.com'}}
+        ]}
+
+    def test_repeated_fan_outs_read_dynamodb_once(self):
+        """Test que las altas y bajas actualizan la caché sin volver a leer DynamoDB"""
+        self.assertEqual(self.manager.get_salon_followers('salon-1'), [('a', 'a@example.com')])
+        self.manager.update_notifications('b', 'b@example.com', 'Subscription', 'salon-1')
+        self.manager.send_unsubscription_notification('a@example.com', 'a', 'salon-1')
+
+        self.assertEqual(self.manager.get_salon_followers('salon-1'), [('b', 'b@example.com')])
+        index_reads = [call for call in self.manager.dynamodb.query.call_args_list if 'IndexName' in call.kwargs]
+        self.assertEqual(len(index_reads), 1)
+
+    def test_unsubscription_deactivates_the_subscription_in_dynamodb(self):
+        """Test que la baja desactiva la suscripción y la saca del índice, no solo de la caché local"""
+        self.manager.dynamodb.query.return_value = {'Items': [{'Timestamp': {'S': 't1'}}]}
+        self.manager.send_unsubscription_notification('a@example.com', 'a', 'salon-1')
+
+        query = self.manager.dynamodb.query.call_args.kwargs
+        self.assertEqual(query['ExpressionAttributeValues'][':key'], {'S': 'a#Subscription#salon-1'})
+        update = self.manager.dynamodb.update_item.call_args.kwargs
+        self.assertEqual(update['Key']['Timestamp'], {'S': 't1'})
+        self.assertEqual(update['UpdateExpression'], 'SET Active = :inactive REMOVE PendingTypeSalon')
+        self.assertEqual(update['ExpressionAttributeValues'][':inactive'], {'BOOL': False})
+
+    def test_memory_bound_and_ttl(self):
+        """Test de la expulsión por presupuesto de seguidores y de la expiración por TTL"""
+        cache = FollowerSetCache(max_followers=3, ttl=60)
+        cache.put('salon-1', [('a', 'a@x'), ('b', 'b@x')])
+        cache.put('salon-2', [('c', 'c@x'), ('d', 'd@x')])
+        self.assertIsNone(cache.get('salon-1'))
+        self.assertEqual(cache.size(), 2)
+
+        cache.ttl = -1
+        cache.put('salon-3', [('e', 'e@x')])
+        self.assertIsNone(cache.get('salon-3'))
+
+class TestOfferDigest(unittest.TestCase):
+
+    def setUp(self):
+        self.priority_manager = PriorityNotificationManager()
+        self.priority_manager.offer_coalescer = OfferCoalescer(window_seconds=60, max_offers=3)
+        self.priority_manager.priority_queue = MagicMock()
+        self.priority_manager.dynamodb = MagicMock()
+        self.priority_manager.sns_client = MagicMock()
+        self.priority_manager.check_existing_notification = MagicMock(return_value=False)
+
+    def _offer(self, user_id, offer_id, receipt_handle):
+        return ('medium', ('Offer', user_id, f'{user_id}@example.com', {
+            'beauty_salon_id': 'salon-1', 'offer_id': offer_id, 'description': f'Offer {offer_id}'
+        }), receipt_handle)
+
+    def test_burst_is_sent_as_one_digest(self):
+        """Test que una ráfaga de ofertas se envía como un único digest y se confirman todos los mensajes"""
+        # t3 es una oferta escrita después de armar el digest: debe seguir pendiente
+        self.priority_manager.dynamodb.query.return_value = {'Items': [
+            {'Timestamp': {'S': 't1'}, 'OfferID': {'S': 'o1'}},
+            {'Timestamp': {'S': 't2'}, 'OfferID': {'S': 'o2'}},
+            {'Timestamp': {'S': 't3'}, 'OfferID': {'S': 'o9'}}
+        ]}
+        self.priority_manager.process_message(self._offer('a', 'o1', 'r1'))
+        self.priority_manager.process_message(self._offer('a', 'o2', 'r2'))
+        self.priority_manager.process_message(self._offer('a', 'o2', 'r3'))
+        self.priority_manager.process_message(self._offer('b', 'o1', 'r4'))
+        self.priority_manager.priority_queue.ack.assert_not_called()
+
+        self.priority_manager.flush_offer_digests(force=True)
+
+        subjects = sorted(call.kwargs['Subject'] for call in self.priority_manager.sns_client.publish.call_args_list)
+        self.assertEqual(subjects, ['New Offer Available', 'New Offers Available'])
+        acked = {call.args[0] for call in self.priority_manager.priority_queue.ack.call_args_list}
+        self.assertEqual(acked, {'r1', 'r2', 'r3', 'r4'})
+        self.assertEqual(self.priority_manager.check_existing_notification.call_count, 2)
+        transaction = self.priority_manager.dynamodb.transact_write_items.call_args.kwargs['TransactItems']
+        self.assertEqual([item['Update']['Key']['Timestamp']['S'] for item in transaction], ['t1', 't2'])
+        self.assertEqual(self.priority_manager.get_digest_stats()['merge_ratio'], 2.0)
+
+    def test_full_digest_is_sent_before_the_window_and_released_on_failure(self):
+        """Test que un digest lleno se envía sin esperar la ventana y se libera si falla"""
+        self.priority_manager.send_offer_digest_notification = MagicMock(side_effect=Exception('SNS caído'))
+        for i in range(3):
+            self.priority_manager.process_message(self._offer('a', f'o{i}', f'r{i}'))
+
+        self.priority_manager.send_offer_digest_notification.assert_called_once()
+        released = [call.args[0] for call in self.priority_manager.priority_queue.release.call_args_list]
+        self.assertEqual(released, ['r0', 'r1', 'r2'])
+        self.assertEqual(self.priority_manager.offer_coalescer.pending_count(), 0)
+
+    def test_expired_digest_is_sent_after_any_message(self):
+        """Test que un digest vencido se envía al procesar un mensaje de otro tipo"""
+        self.priority_manager.send_offer_notification = MagicMock()
+        self.priority_manager.process_message(self._offer('a', 'o1', 'r1'))
+        self.priority_manager.offer_coalescer.window_seconds = 0
+
+        subscription = ('low', ('Subscription', 'b', 'b@example.com', {'beauty_salon_id': 'salon-1'}), 'r2')
+        self.priority_manager.process_message(subscription)
+
+        self.priority_manager.send_offer_notification.assert_called_once()
+        acked = {call.args[0] for call in self.priority_manager.priority_queue.ack.call_args_list}
+        self.assertEqual(acked, {'r1', 'r2'})
+
+class TestEnqueueSpool(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'spool.log')
+        self.sqs = MagicMock()
+        self.sqs.send_message_batch.side_effect = lambda QueueUrl, Entries: {
+            'Successful': [{'Id': entry['Id']} for entry in Entries]
+        }
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_put_is_spooled_and_drained_in_batches(self):
+        """Test que put() escribe en el spool sin llamar a SQS y el flusher envía en lotes"""
+        queue = PriorityNotificationManager().priority_queue
+        queue.sqs = self.sqs
+        queue.priority_queue_urls = {'high': ['high-url'], 'medium': ['medium-url'], 'low': ['low-url']}
+        queue.spool_path, queue.spool = self.path, EnqueueSpool(self.sqs, self.path)
+        for i in range(12):
+            response = queue.put('medium', ('Offer', f'user-{i}', 'e@example.com', {}))
+        queue.put('high', ('Reminder', 'user-x', 'e@example.com', {}))
+
+        self.assertEqual(response, {'SpoolSequence': 12})
+        self.sqs.send_message.assert_not_called()
+        self.assertFalse(queue.empty())
+        self.assertEqual(queue.get_spool_stats()['depth'], 13)
+
+        self.assertEqual(queue.spool.flush(), 13)
+        batch_sizes = sorted(len(call.kwargs['Entries']) for call in self.sqs.send_message_batch.call_args_list)
+        self.assertEqual(batch_sizes, [1, 2, 10])
+        self.assertEqual(queue.get_spool_stats()['depth'], 0)
+        self.assertEqual(queue.spool.flush_lag(), 0.0)
+
+    def test_unsent_entries_survive_outage_and_restart(self):
+        """Test que lo que SQS no aceptó se recupera del disco tras reiniciar el proceso"""
+        self.sqs.send_message_batch.side_effect = ClientError(
+            {'Error': {'Code': 'ServiceUnavailable', 'Message': 'SQS caído'}}, 'SendMessageBatch')
+        spool = EnqueueSpool(self.sqs, self.path)
+        spool.append('medium-url', 'a')
+        spool.append('medium-url', 'b')
+        self.assertEqual(spool.flush(), 0)
+        self.assertEqual(spool.depth(), 2)
+        self.assertGreater(spool.flush_lag(), 0)
+
+        with open(self.path, 'a') as log:
+            log.write('{"seq": 3, "queue_')  # Escritura truncada por la caída
+        spool._lock_file.close()  # La caída del proceso libera el flock
+
+        self.sqs.send_message_batch.side_effect = lambda QueueUrl, Entries: {
+            'Successful': [{'Id': Entries[0]['Id']}]
+        }
+        recovered = EnqueueSpool(self.sqs, self.path)
+        self.assertEqual(recovered.stats['recovered'], 2)
+        self.assertEqual(recovered.flush(), 1)
+        self.assertEqual(recovered.append('medium-url', 'c'), 3)
+        recovered._lock_file.close()
+
+        restarted = EnqueueSpool(self.sqs, self.path)
+        self.assertEqual([record['body'] for record in restarted._pending.values()], ['b', 'c'])
+
+    def test_idle_spool_does_not_fsync(self):
+        """Test que un spool sin escrituras nuevas no hace fsync en cada intervalo"""
+        spool = EnqueueSpool(self.sqs, self.path)
+        for _ in range(5):
+            self.assertEqual(spool.flush(), 0)
+        self.assertEqual(spool.stats['fsyncs'], 0)
+
+        spool.append('medium-url', 'a')
+        self.assertEqual(spool.flush(), 1)
+        spool.flush()  # Sincroniza la marca de enviado
+        for _ in range(5):
+            spool.flush()
+        self.assertEqual(spool.stats['fsyncs'], 2)
+        spool.stop()
+
+    def test_spool_file_is_owned_by_one_process(self):
+        """Test que un segundo spool no puede abrir el mismo archivo mientras el primero lo usa"""
+        spool = EnqueueSpool(self.sqs, self.path)
+        spool.append('medium-url', 'a')
+        with self.assertRaises(RuntimeError):
+            EnqueueSpool(self.sqs, self.path)
+
+        spool.stop()
+        self.assertEqual(self.sqs.send_message_batch.call_count, 1)
+        EnqueueSpool(self.sqs, self.path).stop()
+
+    def test_spool_is_opened_by_the_first_put(self):
+        """Test que el spool solo se abre al encolar (no en los consumidores) y se drena al detenerlo"""
+        queue = PriorityNotificationManager().priority_queue
+        queue.sqs = self.sqs
+        queue.priority_queue_urls = {'high': ['high-url'], 'medium': ['medium-url'], 'low': ['low-url']}
+        queue.spool_path = os.path.join(self.directory.name, 'spool-{pid}.log')
+        self.assertIsNone(queue.spool)
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+        queue.put('medium', ('Offer', 'user-1', 'e@example.com', {}))
+        self.assertTrue(os.path.exists(os.path.join(self.directory.name, f'spool-{os.getpid()}.log')))
+        queue.stop_spool()
+        self.assertIsNone(queue.spool)
+        self.assertEqual(queue.get_spool_stats(), None)
+        sent = sum(len(call.kwargs['Entries']) for call in self.sqs.send_message_batch.call_args_list)
+        self.assertEqual(sent, 1)
+
+class TestTracingAndProfiling(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.priority_manager = PriorityNotificationManager()
+        self.priority_manager.tracer = MessageTracer(os.path.join(self.directory.name, 'trace-{pid}.json'))
+        self.queue = self.priority_manager.priority_queue
+        self.queue.tracer = self.priority_manager.tracer
+        self.queue.sqs = MagicMock()
+        self.queue.priority_queue_urls = {'high': ['high-url'], 'medium': ['medium-url'], 'low': ['low-url']}
+        self.priority_manager.dynamodb = MagicMock()
+        self.priority_manager.dynamodb.query.return_value = {'Items': [{'Timestamp': {'S': 't'}}]}
+        self.priority_manager.sns_client = MagicMock()
+        self.priority_manager.check_existing_notification = MagicMock(return_value=False)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_trace_context_travels_with_the_message(self):
+        """Test que los spans del productor y del consumidor comparten la traza vía atributos de SQS"""
+        self.priority_manager.add_notification_to_queue(
+            'Offer', 'user-1', 'user-1@example.com', beauty_salon_id='salon-1', offer_id='o1', description='Promo')
+        sent = self.queue.sqs.send_message.call_args.kwargs
+        self.assertIn('traceparent', sent['MessageAttributes'])
+
+        self.queue.sqs.receive_message.side_effect = lambda QueueUrl, **kwargs: {'Messages': [{
+            'Body': sent['MessageBody'], 'ReceiptHandle': 'r1', 'MessageAttributes': sent['MessageAttributes']
+        }]} if QueueUrl == sent['QueueUrl'] else {}
+        message = self.queue.receive()
+        self.priority_manager.process_message(message)
+
+        with open(self.priority_manager.tracer.export()) as trace_file:
+            events = json.load(trace_file)['traceEvents']
+        names = {event['name'] for event in events}
+        self.assertEqual(names, {'enqueue', 'dequeue', 'decode', 'process_message', 'dedup_check', 'publish', 'status_update'})
+        self.assertEqual(len({event['args']['trace_id'] for event in events}), 1)
+        self.assertTrue(all(event['ph'] == 'X' and event['dur'] >= 0 for event in events))
+        spans = {event['name']: event['args'] for event in events}
+        self.assertEqual(spans['status_update']['parent_id'], spans['publish']['span_id'])
+
+    def test_disabled_tracer_is_a_no_op(self):
+        """Test que sin ruta de exportación no se miden spans ni se añaden atributos al mensaje"""
+        tracer = MessageTracer()
+        self.assertFalse(tracer.enabled)
+        self.assertIs(tracer.span('publish'), tracer.span('dedup_check'))
+        self.assertIsNone(tracer.record('dequeue', None, 0, 1))
+        self.assertIsNone(tracer.export())
+
+        self.priority_manager.tracer = self.queue.tracer = tracer
+        self.priority_manager.add_notification_to_queue('Offer', 'user-1', 'user-1@example.com', beauty_salon_id='salon-1')
+        self.assertNotIn('MessageAttributes', self.queue.sqs.send_message.call_args.kwargs)
+
+    def test_sampling_profiler_toggles_and_dumps_folded_stacks(self):
+        """Test que el profiler se activa en caliente y vuelca las pilas agregadas"""
+        stop = threading.Event()
+        def busy_consumer_loop():
+            while not stop.is_set():
+                sum(range(1000))
+        worker = threading.Thread(target=busy_consumer_loop, name='consumer-worker')
+        worker.start()
+        profiler = SamplingProfiler(interval=0.001, dump_interval=0,
+                                    output_path=os.path.join(self.directory.name, 'profile-{pid}.folded'))
+        try:
+            self.assertTrue(profiler.toggle())
+            deadline = time.time() + 5
+            while profiler.samples < 20 and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertFalse(profiler.toggle())
+        finally:
+            stop.set()
+            worker.join()
+
+        self.assertTrue(any('busy_consumer_loop' in stack for stack, _ in profiler.top()))
+        with open(profiler.dump()) as profile:
+            line = profile.readline()
+        self.assertIn(';', line)
+        self.assertTrue(line.rstrip().split(' ')[-1].isdigit())
+
+    def test_signal_only_requests_the_toggle(self):
+        """Test que SIGUSR2 solo marca la petición y el cambio lo hace un hilo aparte"""
+        profiler = SamplingProfiler(interval=0.001, dump_interval=0,
+                                    output_path=os.path.join(self.directory.name, 'profile-{pid}.folded'))
+        previous = signal.getsignal(signal.SIGUSR2)
+        try:
+            self.assertTrue(profiler.install_signal_toggle())
+            os.kill(os.getpid(), signal.SIGUSR2)
+            deadline = time.time() + 5
+            while not profiler.is_running() and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertTrue(profiler.is_running())
+            self.assertIsNot(profiler._toggle_thread, threading.main_thread())
+        finally:
+            signal.signal(signal.SIGUSR2, previous)
+            profiler.stop()
+
 if __name__ == '__main__':
     try:
         # Inicializar y crear tabla